@@ -7,12 +7,16 @@
 # INGV, IPGP, ISC, KNMI, KOERI, LMU, NCEDC, NIEP, NOA, RESIF, RESIFPH5, SCEDC,
 # TEXNET, UIB-NORSAR, USGS, USP, ORFEUS, IRIS
 ###############################################################################
-import obspy, os
+import os
 from obspy.clients.fdsn.mass_downloader import (
     RectangularDomain,
     Restrictions,
-    MassDownloader,
 )
+from nafz.archive import coalesce_windows, cut_event_windows, day_segments, event_windows
+from nafz.catalog_index import CatalogIndex
+from nafz.download import DownloadScheduler
+from nafz.inventory_store import InventoryStore
+from nafz.journal import DownloadJournal
 
 ###############################################################################
 # MINLAT = 40.00
@@ -38,59 +42,49 @@ if os.path.exists("response"):
 else:
     os.mkdir("response")
 
-###############################################################################
-elf = open("catlog/Poyraz_2015_catlog.par", "r")
-el = elf.read().splitlines()
-elf.close()
-
-i = 571
-while i < len(el):
-    event = el[i].split()
-
-    event_dir = event[0]
-    ymd = event[1]
-    hour = event[2]
-    mini = event[3]
-    msec = event[4]
-
-    lat = event[5]
-    lon = event[6]
-    depth = event[7]
-
-    origin_time = obspy.UTCDateTime(ymd + " " + hour + ":" + mini + ":" + msec)
-
-    # event_dir = ymd + '.' + hour.zfill(2) + '.' + mini.zfill(2)
-
-    print("\033[1;34m Start downloading data for a new event \033[0m")
-    print("event number: " + str(i) + "; " + event_dir)
-
-    # Circular domain around the epicenter. This will download all data between
-    # 70 and 90 degrees distance from the epicenter. This module also offers
-    # rectangular and global domains. More complex domains can be defined by
-    # inheriting from the Domain class.
-    # domain = CircularDomain(latitude=37.52, longitude=143.04,
-    #                         minradius=70.0, maxradius=90.0)
-
-    # Rectangular domain
-    domain = RectangularDomain(
-        minlatitude=MINLAT,
-        maxlatitude=MAXLAT,
-        minlongitude=MINLON,
-        maxlongitude=MAXLON,
-    )
+os.makedirs("log", exist_ok=True)
+
+inventory_store = InventoryStore("response/stations")
 
-    restrictions = Restrictions(
+###############################################################################
+catalog = CatalogIndex.load("catlog/Poyraz_2015_catlog.par")
+
+# Events are downloaded concurrently; each provider gets its own limit on
+# simultaneous requests, and failed requests are retried with backoff.
+# The journal records what has been downloaded: a rerun skips completed events
+# and retries only the failed ones (delete the journal to start over).
+journal = DownloadJournal("log/download_journal.sqlite")
+max_events_in_parallel = 6
+provider_limits = {"KOERI": 2, "IRIS": 4}
+
+
+# Download mode:
+#   "event"     one request per event window
+#   "coalesce"  overlapping or nearby event windows are merged into longer
+#               requests (at most max_segment_min long)
+#   "day"       one day-long continuous request per day with events
+# In the last two modes the requests go to ./archive/ and the event windows
+# are cut locally into ./data/<event_dir>/.
+download_mode = "event"
+max_gap_min = 2.0
+max_segment_min = 60.0
+
+
+def make_restrictions(starttime, endtime, continuous=False):
+    # continuous: archive request spanning several event windows, the gap and
+    # length checks are then applied per event window when cutting
+    return Restrictions(
         # Get data from 5 minutes before the event to one hour after the
         # event. This defines the temporal bounds of the waveform data.
-        starttime=origin_time - pre_event_min * 60,
-        endtime=origin_time + aft_event_min * 60,
+        starttime=starttime,
+        endtime=endtime,
         # You might not want to deal with gaps in the data. If this setting is
         # True, any trace with a gap/overlap will be discarded.
-        reject_channels_with_gaps=True,
+        reject_channels_with_gaps=not continuous,
         # And you might only want waveforms that have data for at least 95 % of
         # the requested time span. Any trace that is shorter than 95 % of the
         # desired total duration will be discarded.
-        minimum_length=0.90,
+        minimum_length=0.0 if continuous else 0.90,
         # No two stations should be closer than 10 km to each other. This is
         # useful to for example filter out stations that are part of different
         # networks but at the same physical station. Settings this option to
@@ -103,24 +97,107 @@ while i < len(el):
         # Location codes are arbitrary and there is no rule as to which
         # location is best. Same logic as for the previous setting.
         location_priorities=["", "00", "10"],
+        # Request station metadata for the whole campaign instead of the event
+        # window, so later events find the station's StationXML as existing.
+        station_starttime=campaign_start,
+        station_endtime=campaign_end,
     )
 
-    # No specified providers will result in all known ones being queried.
 
-    mdl = MassDownloader(
-        providers=[
-            "KOERI",
-            "IRIS",
-        ]
-    )
+# Circular domain around the epicenter. This will download all data between
+# 70 and 90 degrees distance from the epicenter. This module also offers
+# rectangular and global domains. More complex domains can be defined by
+# inheriting from the Domain class.
+# domain = CircularDomain(latitude=37.52, longitude=143.04,
+#                         minradius=70.0, maxradius=90.0)
 
-    # The data will be downloaded to the ``./waveforms/`` and ``./stations/``
-    # folders with automatically chosen file names.
-    mdl.download(
-        domain,
-        restrictions,
-        mseed_storage="data/" + event_dir,
-        stationxml_storage="response/" + event_dir,
-    )
+# Rectangular domain
+domain = RectangularDomain(
+    minlatitude=MINLAT,
+    maxlatitude=MAXLAT,
+    minlongitude=MINLON,
+    maxlongitude=MAXLON,
+)
+
+windows = event_windows(catalog.events(), pre_event_min * 60, aft_event_min * 60)
+if download_mode == "event":
+    spans = windows
+else:
+    if download_mode == "day":
+        segments = day_segments(windows)
+    else:
+        segments = coalesce_windows(windows, max_gap_min * 60, max_segment_min * 60)
+    print(f"{len(windows)} event windows merged into {len(segments)} {download_mode} requests")
+    spans = segments
+
+# Station metadata is requested for the whole campaign, so one StationXML file
+# per station (response/stations/NET.STA.xml) serves every event. The campaign
+# spans the catalog's first to last origin plus the download padding (every
+# request must lie inside the station window).
+campaign_start = min(span.starttime for span in spans)
+campaign_end = max(span.endtime for span in spans)
+
+if download_mode == "event":
+    # The waveforms are downloaded to ``./data/<event_dir>/``, the StationXML
+    # files to the campaign-wide ``./response/stations/``.
+    requests = [
+        (w.name, domain, make_restrictions(w.starttime, w.endtime), "data/" + w.name, inventory_store.storage)
+        for w in windows
+    ]
+else:
+    requests = [
+        (seg.name, domain, make_restrictions(seg.starttime, seg.endtime, continuous=True), "archive", inventory_store.storage)
+        for seg in segments
+    ]
+
+# Providers are tried in this order for every event.
+scheduler = DownloadScheduler(
+    providers=[
+        "KOERI",
+        "IRIS",
+    ],
+    provider_limits=provider_limits,
+    max_workers=max_events_in_parallel,
+    journal=journal,
+    # One availability query per provider for the whole campaign; the
+    # clients stay alive for the whole run
+    availability_window=(campaign_start, campaign_end),
+)
 
-    i = i + 1
+# Fetch the responses of all stations in the domain once, one request per
+# provider in priority order; stations missing here are still picked up by the
+# per-event downloads.
+for provider in scheduler.providers:
+    try:
+        fetched = inventory_store.prefetch(
+            scheduler.client(provider),
+            campaign_start,
+            campaign_end,
+            MINLAT, MAXLAT, MINLON, MAXLON,
+        )
+        print(f"{provider}: StationXML of {len(fetched)} station(s) stored in {inventory_store.root}")
+    except Exception as e:
+        print(f"{provider}: StationXML prefetch failed ({e}), falling back to per-event requests")
+
+results = scheduler.run(requests)
+
+if download_mode != "event":
+    # Cut the event windows out of every archived request (also the ones
+    # completed in earlier runs; existing event files are left alone)
+    done = journal.completed()
+    written = rejected = 0
+    for seg in segments:
+        if seg.name in done:
+            n, r = cut_event_windows(seg, "archive", "data", minimum_length=0.90, reject_gaps=True)
+            written += n
+            rejected += r
+    print(f"Cut {written} event files from the archive ({rejected} rejected for gaps or short data)")
+
+failed = [result for result in results if result.status == "failed"]
+print(f"Downloaded {sum(result.bytes for result in results) / 1024 ** 2:.1f} MB for {len(results)} requests")
+if failed:
+    print(f"\033[1;31m {len(failed)} request(s) failed: \033[0m" + ", ".join(result.name for result in failed))
+
+for status, (n, files, size) in sorted(journal.summary().items()):
+    print(f"Journal: {n} request(s) {status}, {files} files, {size / 1024 ** 2:.1f} MB")
+journal.close()
@@ -5,117 +5,343 @@
 # CAP from 2013 to 2015
 ###############################################################################
 import os
-import subprocess
-from obspy import read, read_inventory, UTCDateTime
+import shutil
+from obspy import read, UTCDateTime
 import multiprocessing as mp
 from tqdm.auto import tqdm
+from nafz.catalog_index import CatalogIndex
+from nafz.deconvolve import ResponseDeconvolver
+from nafz.event_store import EventContainer, channel_entry, container_ref
+from nafz.inventory_store import InventoryStore
+from nafz.manifest import ProcessingManifest
+from nafz.response_cache import channel_response, response_table
+from nafz.sac_header import event_station_geometry, set_sac_headers
+from nafz.trace_index import TraceIndex
 
 def create_directories(*dirs):
     for dir in dirs:
         os.makedirs(dir, exist_ok=True)
 
-def process_mseed(event_dir, mseed, origin_time, evla, evlo, evdp, hour, mini, msec, error_resp_station):
+def link_or_copy(src, dst):
+    # The local_vel_data trees hold the same files as vel_data: hardlink them,
+    # copying only where the filesystem has no hardlinks
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+inventory_store = InventoryStore("response/stations")
+
+manifest_path = "log/remove_response_manifest.sqlite"
+# nafz.trace_index database of the written SAC files, used by the later stages
+trace_index_path = "log/trace_index.sqlite"
+
+deconvolver = ResponseDeconvolver(output="VEL", pre_filt=[0.8, 1, 20, 22])
+
+# Ground-motion outputs to write, any of DISP/VEL/ACC. All of them come from
+# one FFT and deconvolution per trace; only VEL feeds the local_vel_data trees.
+# ACC derived from VEL is not clipped by the water level as obspy's ACC is
+# (see nafz/deconvolve.py); ResponseDeconvolver(..., exact=True) reproduces
+# obspy's remove_response for every output.
+outputs = ["VEL"]
+output_dirs = {"DISP": "disp_data", "VEL": "vel_data", "ACC": "acc_data"}
+
+# "sac": one SAC file per trace in output_dirs (and the local_vel_data trees);
+# "h5": one nafz.event_store container per event in container_dir, holding all
+# outputs; the local_vel_data trees that stages 3 and 4 read are exported from
+# it as SAC files (EventContainer.export_sac)
+output_format = "sac"
+container_dir = "waveform_h5"
+
+# Epicentral distance window [km] of the local_vel_data trees. Stations outside
+# distance_range_km are skipped before any processing (None processes all).
+local_distance_km = (2, 100)
+distance_range_km = local_distance_km
+
+def station_distance(event_dir, mseed, origin_time, evla, evlo):
+    # Epicentral distance [km] of a channel file (NET.STA.LOC.CHA__...) from
+    # its StationXML coordinates, None if they are unknown
+    network, station, location, channel = mseed.split("__")[0].split(".")[:4]
+    resp = inventory_store.resolve(event_dir, network, station)
+    try:
+        _, (stla, stlo, _) = channel_response(resp, f"{network}.{station}.{location}.{channel}", origin_time)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        try:
+            stla, stlo, _ = response_table(resp)["station"]
+        except Exception:
+            return None
+    return event_station_geometry(evla, evlo, stla, stlo)[0]
+
+def prepare_mseed(event_dir, mseed, error_resp_station):
+    # Read one channel file, pre-process it and attach its response.
+    # Returns (no_resp, error_resp, (st, stla, stlo, stel) or None)
     st = read(f"data/{event_dir}/{mseed}")
     head = st[0]
     
     station_id = f"{head.stats.network}.{head.stats.station}"
     
-    resp = f"response/{event_dir}/{station_id}.xml"
+    resp = inventory_store.resolve(event_dir, head.stats.network, head.stats.station)
+    # Responses are parsed once per campaign (nafz.response_cache)
     try:
-        inv = read_inventory(resp)
+        table = response_table(resp)
     except FileNotFoundError:
-        return f"{event_dir}: {station_id}.{head.stats.channel}", None
+        return f"{event_dir}: {station_id}.{head.stats.channel}", None, None
     
     if station_id in error_resp_station:
-        return None, None
+        return None, None, None
     
-    stla, stlo, stel = inv.networks[0].stations[0].latitude, inv.networks[0].stations[0].longitude, inv.networks[0].stations[0].elevation
+    # Campaign files hold several epochs, take the one valid for this trace
+    try:
+        _, (stla, stlo, stel) = channel_response(resp, head.id, head.stats.starttime)
+    except Exception:
+        stla, stlo, stel = table["station"]
     
     st.detrend(type="demean")
     st.detrend(type="linear")
     st.taper(max_percentage=0.05)
     
     try:
-        st.remove_response(inventory=inv, output="VEL", pre_filt=[0.8, 1, 20, 22])
+        for tr in st:
+            tr.stats.response, _ = channel_response(resp, tr.id, tr.stats.starttime)
     except Exception:
-        return None, f"{event_dir}: {station_id}.{head.stats.channel}"
+        return None, f"{event_dir}: {station_id}.{head.stats.channel}", None
     
+    return None, None, (st, stla, stlo, stel)
+
+def write_outputs(event_dir, st, data, stla, stlo, stel, origin_time, evla, evlo, evdp, hour, mini, msec):
+    # data: {output: [array per trace of st]}
+    head = st[0]
+    station_id = f"{head.stats.network}.{head.stats.station}"
     newsacname = f"{origin_time.year}.{origin_time.julday:03d}.{hour}.{mini}.{msec}.{station_id}..{head.stats.channel}.SAC"
-    output_path = f"vel_data/{event_dir}/{newsacname}"
-    st.write(output_path, format="SAC")
+    # Event/station headers, dist/az/baz/gcarc as with SAC's LCALDA
+    for tr in st:
+        header = set_sac_headers(tr, evla, evlo, evdp, stla, stlo, stel, origin_time)
+    if output_format == "h5":
+        # Container entries, written by the main process
+        return {output: [channel_entry(tr, newsacname, trace_data) for tr, trace_data in zip(st, data[output])]
+                for output in outputs}
+    written = []
+    for output in outputs:
+        for tr, trace_data in zip(st, data[output]):
+            tr.data = trace_data
+        written.append(f"{output_dirs[output]}/{event_dir}/{newsacname}")
+        st.write(written[-1], format="SAC")
     
-    update_sac_headers(output_path, evlo, evla, evdp, stlo, stla, stel, origin_time, hour, mini, msec)
-    
-    local_st = read(output_path)
-    if 2 <= local_st[0].stats.sac.dist <= 100:
-        local_st.write(f"local_vel_data/{event_dir}/{newsacname}", format="SAC")
+    if "VEL" in outputs and local_distance_km[0] <= header["dist"] <= local_distance_km[1]:
+        output_path = f"vel_data/{event_dir}/{newsacname}"
+        written.append(f"local_vel_data/{event_dir}/{newsacname}")
+        link_or_copy(output_path, written[-1])
         if newsacname.endswith(".BHZ.SAC"):
-            local_st.write(f"local_vel_data_BHZ/{event_dir}/{newsacname}", format="SAC")
-    
-    return None, None
-
-def update_sac_headers(sac_file, evlo, evla, evdp, stlo, stla, stel, origin_time, hour, mini, msec):
-    s = f"""
-    wild echo off
-    r {sac_file}
-    ch LCALDA True
-    ch evlo {evlo} evla {evla} evdp {evdp}
-    ch stlo {stlo} stla {stla} stel {stel}
-    ch t1 0.0 t2 0.0 t3 0.0 t4 0.0
-    ch o gmt {origin_time.year} {origin_time.julday} {hour} {mini} {msec.split('.')[0]} {msec.split('.')[1]}
-    wh
-    q
-    """
-    subprocess.run(["sac"], input=s.encode(), check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-def process_event(event_line):
-    event = event_line.split()
-    event_dir, ymd, hour, mini, msec, evla, evlo, evdp = event[:8]
-    origin_time = UTCDateTime(f"{ymd} {hour}:{mini}:{msec}")
+            written.append(f"local_vel_data_BHZ/{event_dir}/{newsacname}")
+            link_or_copy(output_path, written[-1])
+    return written
+
+def write_container(task, entries):
+    # Replace the station of a task in its event container and export its
+    # local VEL traces to the local_vel_data trees; returns the manifest
+    # references of the container and the exported SAC files
+    event_dir, mseeds, origin_time, evla, evlo, evdp = task[:6]
+    station = ".".join(mseeds[0].split(".")[:2])
+    path = f"{container_dir}/{event_dir}.h5"
+    exported = []
+    with EventContainer(path, "a") as container:
+        container.set_event(name=event_dir, origin=str(origin_time), evla=evla, evlo=evlo, evdp=evdp)
+        for output in outputs:
+            if entries.get(output):
+                container.write_station(output, station, entries[output])
+        local = [
+            entry["channel"] for entry in entries.get("VEL", [])
+            if local_distance_km[0] <= entry["sac"].get("dist", -1) <= local_distance_km[1]
+        ]
+        if local:
+            exported += container.export_sac("VEL", f"local_vel_data/{event_dir}", [station], local)
+        if "BHZ" in local:
+            exported += container.export_sac("VEL", f"local_vel_data_BHZ/{event_dir}", [station], ["BHZ"])
+    return [container_ref(path, output, station) for output in outputs if entries.get(output)], exported
+
+def process_station(event_dir, mseeds, origin_time, evla, evlo, evdp, hour, mini, msec, error_resp_station):
+    # All channel files of one station: their responses are removed together
+    # in one batched FFT (nafz.deconvolve)
+    no_resp_station, error_resp, prepared, written = [], [], [], []
+    entries = {}
+    skipped = 0
+    for mseed in mseeds:
+        if distance_range_km is not None:
+            dist = station_distance(event_dir, mseed, origin_time, evla, evlo)
+            if dist is not None and not distance_range_km[0] <= dist <= distance_range_km[1]:
+                skipped += 1
+                continue
+        no_resp, error, item = prepare_mseed(event_dir, mseed, error_resp_station)
+        if no_resp:
+            no_resp_station.append(no_resp)
+        if error:
+            error_resp.append(error)
+        if item:
+            prepared.append(item)
     
-    create_directories(f"vel_data/{event_dir}", f"local_vel_data/{event_dir}", f"local_vel_data_BHZ/{event_dir}")
+    done, _ = deconvolver.deconvolve([tr for st, *_ in prepared for tr in st], outputs)
+    done = {id(tr): result for tr, result in done}
+    for st, stla, stlo, stel in prepared:
+        if not all(id(tr) in done for tr in st):
+            error_resp.append(f"{event_dir}: {st[0].stats.network}.{st[0].stats.station}.{st[0].stats.channel}")
+            continue
+        data = {output: [done[id(tr)][output] for tr in st] for output in outputs}
+        result = write_outputs(event_dir, st, data, stla, stlo, stel, origin_time, evla, evlo, evdp, hour, mini, msec)
+        if output_format == "h5":
+            for output in outputs:
+                entries.setdefault(output, []).extend(result[output])
+        else:
+            written += result
     
-    os.system(f"ls data/{event_dir}/*.mseed > data/{event_dir}/mseedfiles.txt")
+    return no_resp_station, error_resp, skipped, written, entries
+
+def event_tasks(event):
+    # One task per station of an event: (event_dir, channel files, origin
+    # time, evla, evlo, evdp, hour, mini, msec)
+    event_dir, ymd, hour, mini, msec = event.name, event.ymd, event.hour, event.minute, event.second
+    evla, evlo, evdp = event.latitude, event.longitude, event.depth
+    origin_time = UTCDateTime(f"{ymd} {hour}:{mini}:{msec}")
     
-    with open(f"data/{event_dir}/mseedfiles.txt", "r") as mseedlf:
-        mseedl = mseedlf.read().splitlines()
+    if output_format == "sac":
+        create_directories(*(f"{output_dirs[output]}/{event_dir}" for output in outputs))
+    create_directories(f"local_vel_data/{event_dir}", f"local_vel_data_BHZ/{event_dir}")
     
-    error_resp_station = set()
-    no_resp_station = []
+    try:
+        mseedl = sorted(name for name in os.listdir(f"data/{event_dir}") if name.endswith(".mseed"))
+    except FileNotFoundError:
+        return []
     
+    # Channel files (NET.STA.LOC.CHA__start__end.mseed) grouped by station
+    stations = {}
     for mseed in mseedl:
-        no_resp, error_resp = process_mseed(event_dir, os.path.basename(mseed), origin_time, evla, evlo, evdp, hour, mini, msec, error_resp_station)
-        if no_resp:
-            no_resp_station.append(no_resp)
-        if error_resp:
-            error_resp_station.add(error_resp)
+        stations.setdefault(tuple(mseed.split(".")[:2]), []).append(mseed)
     
-    return no_resp_station, list(error_resp_station)
+    return [(event_dir, mseeds, origin_time, evla, evlo, evdp, hour, mini, msec) for mseeds in stations.values()]
+
+def processing_params():
+    # Everything besides the input files that changes the outputs
+    return {
+        "output": deconvolver.output,
+        "pre_filt": list(deconvolver.pre_filt) if deconvolver.pre_filt else None,
+        "water_level": deconvolver.water_level,
+        "taper_fraction": deconvolver.taper_fraction,
+        "fast_nfft": deconvolver.fast_nfft,
+        "exact": deconvolver.exact,
+        "outputs": list(outputs),
+        "distance_range_km": list(distance_range_km) if distance_range_km else None,
+        "local_distance_km": list(local_distance_km),
+        "output_format": output_format,
+    }
+
+def task_key(task):
+    event_dir, mseeds = task[:2]
+    return f"{event_dir}/{'.'.join(mseeds[0].split('.')[:2])}"
+
+def task_inputs(task):
+    # Channel files and StationXML of a task
+    event_dir, mseeds = task[:2]
+    network, station = mseeds[0].split(".")[:2]
+    return [f"data/{event_dir}/{mseed}" for mseed in mseeds] + [inventory_store.resolve(event_dir, network, station)]
+
+def task_fingerprint(manifest, task, params):
+    # Input files and event parameters of a task
+    origin_time, evla, evlo, evdp = task[2:6]
+    event = {"origin": str(origin_time), "evla": float(evla), "evlo": float(evlo), "evdp": float(evdp)}
+    return manifest.fingerprint(task_inputs(task), dict(params, event=event))
+
+def process_task(indexed_task):
+    index, task = indexed_task
+    return index, process_station(*task, set())
+
+def warm_response_cache(tasks):
+    # Parse the StationXML of the stations to process once, before the pool
+    # starts: forked workers inherit the tables, others load the pickled ones
+    # (nafz.response_cache) of the stations they get
+    paths = {inventory_store.resolve(task[0], *task[1][0].split(".")[:2]) for task in tasks}
+    for path in sorted(paths):
+        try:
+            response_table(path)
+        except Exception:
+            pass
 
 def main():
-    create_directories("vel_data", "local_vel_data", "local_vel_data_BHZ")
+    if output_format == "h5":
+        create_directories(container_dir)
+    else:
+        create_directories(*(output_dirs[output] for output in outputs))
+    create_directories("local_vel_data", "local_vel_data_BHZ")
     
-    with open("catlog/Poyraz_2015_catlog.par", "r") as eplf:
-        epls = eplf.read().splitlines()
+    catalog = CatalogIndex.load("catlog/Poyraz_2015_catlog.par")
+    tasks = [task for event in catalog.events() for task in event_tasks(event)]
     
-    pool = mp.Pool(processes=mp.cpu_count())
+    # Tasks whose inputs and parameters are unchanged since the last run are
+    # taken from the manifest; delete it to reprocess everything
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    manifest = ProcessingManifest(manifest_path)
+    trace_index = TraceIndex(trace_index_path)
+    params = processing_params()
+    processes = mp.cpu_count()
+    # New and changed input files are hashed in parallel; the fingerprints
+    # below then only look up cached hashes (unchanged files: size and mtime)
+    hashed = manifest.hash_files([path for task in tasks for path in task_inputs(task)], processes)
+    if hashed:
+        print(f"Hashed {hashed} new or changed input files")
+    keys = [task_key(task) for task in tasks]
+    fingerprints = [task_fingerprint(manifest, task, params) for task in tasks]
+    results = {}
+    for index, (key, fingerprint) in enumerate(zip(keys, fingerprints)):
+        result = manifest.current(key, fingerprint)
+        if result is not None:
+            results[index] = result
+    todo = [(index, task) for index, task in enumerate(tasks) if index not in results]
+    print(f"{len(tasks) - len(todo)} of {len(tasks)} station tasks are up to date")
     
-    results = list(tqdm(
-        pool.imap(process_event, epls),
-        total=len(epls),
-        desc="Processing events",
-        unit="event",
-        smoothing=0.1
-    ))
+    # Stations of all events are scheduled together, so large events do not
+    # hold up a worker; idle workers take the next chunk of the shared queue
+    chunksize = max(1, min(16, len(todo) // (processes * 8)))
+    warm_response_cache([task for _, task in todo])
+    with mp.Pool(processes=processes) as pool:
+        for index, (no_resp, error_resp, skipped_station, written, entries) in tqdm(
+            pool.imap_unordered(process_task, todo, chunksize=chunksize),
+            total=len(todo),
+            desc="Processing stations",
+            unit="station",
+            smoothing=0.1
+        ):
+            results[index] = [no_resp, error_resp, skipped_station]
+            refs = []
+            if output_format == "h5":
+                refs, written = write_container(tasks[index], entries)
+            trace_index.add_files(written)
+            manifest.record(keys[index], fingerprints[index], params, refs + written, results[index])
     
-    pool.close()
-    pool.join()
+    # Outputs of events and stations that are no longer in the inputs
+    pruned, removed = manifest.prune(keys)
+    if pruned:
+        print(f"Removed {removed} outputs of {pruned} obsolete station tasks")
+    manifest.close()
+    # Drop the index rows of removed outputs, also of datasets no longer
+    # written (dropped outputs, h5 format); unchanged files are not read
+    datasets = set(trace_index.datasets()) | {"local_vel_data", "local_vel_data_BHZ"}
+    if output_format == "sac":
+        datasets.update(output_dirs[output] for output in outputs)
+    for dataset in sorted(datasets):
+        trace_index.sync(dataset)
+    trace_index.close()
     
+    # Aggregated in catalog order, as listed before
     no_resp_station = []
     error_resp_station = set()
-    for no_resp, error_resp in results:
+    skipped = 0
+    for index in range(len(tasks)):
+        no_resp, error_resp, skipped_station = results[index]
         no_resp_station.extend(no_resp)
         error_resp_station.update(error_resp)
+        skipped += skipped_station
 
     with open("1_remove_resp_log.txt", "w") as log:
         log.write("--------------------------------------------------------------------------\n")
@@ -123,6 +349,8 @@ def main():
         log.write("\n".join(no_resp_station) + "\n")
         log.write(f"{len(error_resp_station)} stations have wrong response file, listed as follows:\n")
         log.write("\n".join(error_resp_station) + "\n")
+        if distance_range_km is not None:
+            log.write(f"{skipped} traces skipped outside {distance_range_km[0]}-{distance_range_km[1]} km epicentral distance\n")
 
 if __name__ == "__main__":
     main()
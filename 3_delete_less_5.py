@@ -6,59 +6,53 @@
 # 3. Updating event catalogs
 # For CAP (Cut and Paste) data from2013 to 2015
 ###############################################################################
-import glob
 import os
-from obspy import read, UTCDateTime
+import shutil
+import numpy as np
+from obspy import UTCDateTime
+from nafz.catalog_index import CatalogIndex
+from nafz.catalog_format import format_par_lines
+from nafz.records import StationRecord, records, station_table
+from nafz.trace_index import TraceIndex
 
 ###############################################################################
-class Station:
-    # Represents a seismic station with its attributes
-    def __init__(self, name, lat, lon, dep):
-        self.name = name
-        self.lat = lat
-        self.lon = lon
-        self.dep = dep
-
-    def __repr__(self):
-        return repr((self.name, self.lat, self.lon, self.dep))
-
-
 def load_event_catalog(file_path):
-    # Load the event catalog from a file
-    with open(file_path, "r") as file:
-        return file.read().splitlines()
+    # Load the indexed event catalog
+    return CatalogIndex.load(file_path)
 
 
-def process_event_directory(event_dir, event_info, station_flag):
+def process_event_directory(event_dir, event_name, station_flag, trace_index):
     # Process an event directory:
     # - Check if directory exists
     # - Count SAC files (excluding KO network)
     # - Delete directory if fewer than 5 SAC files
     # - Extract station info if needed
-    try:
-        os.chdir(f"local_vel_data/{event_dir}/")
-    except FileNotFoundError:
-        print(f"The records of {event_info[0]}-{event_dir} have been deleted, skipping")
+    # The SAC files and their headers come from the trace index
+    if not os.path.isdir(f"local_vel_data/{event_dir}"):
+        print(f"The records of {event_name}-{event_dir} have been deleted, skipping")
         return False, 0
 
     # Get all SAC files and filter out KO network
-    all_sac_files = glob.glob("*.SAC")
-    sac_files = [f for f in all_sac_files if not f.split('.')[6] == 'KO']
+    sac_files = [
+        (os.path.basename(row["path"]), row)
+        for row in trace_index.traces("local_vel_data", event=event_dir)
+        if not os.path.basename(row["path"]).split('.')[6] == 'KO'
+    ]
 
     if len(sac_files) < 9:
-        print(f"The records of {event_info[0]}-{event_dir} is less than 9 (excluding KO network), deleting")
-        os.chdir("../")
-        os.system(f"rm -r {event_dir}")
-        os.chdir("../")
+        print(f"The records of {event_name}-{event_dir} is less than 9 (excluding KO network), deleting")
+        shutil.rmtree(f"local_vel_data/{event_dir}")
+        trace_index.remove("local_vel_data", event=event_dir)
         return False, 0
 
     if station_flag:
         extract_station_info(sac_files)
 
     # Update sacfiles.txt with non-KO files
-    if not os.path.exists("sacfiles.txt"):
-        with open("sacfiles.txt", "w") as f:
-            for sac_file in sac_files:
+    sacfiles_path = f"local_vel_data/{event_dir}/sacfiles.txt"
+    if not os.path.exists(sacfiles_path):
+        with open(sacfiles_path, "w") as f:
+            for sac_file, _ in sac_files:
                 if sac_file.endswith(".BH?.SAC"):
                     f.write(f"{sac_file}\n")
 
@@ -66,47 +60,40 @@ def process_event_directory(event_dir, event_info, station_flag):
 
 
 def extract_station_info(sac_files):
-    # Extract station information from SAC files
-    for file_name in sac_files:
-        try:
-            header = read(file_name)[0].stats
-            # Skip KO network stations
-            if header.network == "KO":
-                continue
-                
-            net_sta_name = f"{header.network}.{header.station}"
-
-            if net_sta_name not in station_names:
-                station_names.add(net_sta_name)
-                station_data.append(
-                    Station(
-                        net_sta_name,
-                        header.sac.stla,
-                        header.sac.stlo,
-                        header.sac.stel,
-                    )
-                )
-        except AttributeError:
+    # Extract station information from the indexed SAC headers
+    for file_name, row in sac_files:
+        # Skip KO network stations
+        if row["network"] == "KO":
+            continue
+
+        if None in (row["network"], row["station"], row["stla"], row["stlo"], row["stel"]):
             print(f"[ERROR3] Header info wrong: {file_name}")
+            continue
 
-def write_updated_event_par_files(event_lines, all_sac, left_event, deleted_events):
-    # Write updated event parameter files
+        net_sta_name = f"{row['network']}.{row['station']}"
+
+        if net_sta_name not in station_names:
+            station_names.add(net_sta_name)
+            station_data.append((net_sta_name, row["stla"], row["stlo"], row["stel"]))
+
+def write_updated_event_par_files(events, kept, all_sac, left_event, deleted_events):
+    # Write updated event parameter files for the kept catalog indices
+    par_lines = format_par_lines(events.to_frame(kept))
     with open("log/Poyraz_2015_catlog_updated.par", "w") as new_elf, open(
         "log/Poyraz_2015_catlog_updated-2.par", "w"
     ) as new_elf2:
-        for line in event_lines:
+        for line, event in zip(par_lines, events.events(kept)):
             # Write original format to the first file
             new_elf.write(line + "\n")
-            # Parse event details and write to the second file with specific formatting
-            event = line.split()
+            # Write event details to the second file with specific formatting
             origin_time = UTCDateTime(
-                f"{event[1]} {event[2]}:{event[3]}:{event[4]}"
+                f"{event.ymd} {event.hour}:{event.minute}:{event.second}"
             )
             
             new_elf2.write(
-                f"{event[1]:<9} {origin_time.year:<5} {origin_time.julday:<4} "
-                f"{event[2]:<3} {event[3]:<3} {event[4]:<8} "
-                f"{event[5]:<10} {event[6]:<10} {event[7]:<4} 8.4 25.6 {event[10]:<3} MB\n"
+                f"{event.ymd:<9} {origin_time.year:<5} {origin_time.julday:<4} "
+                f"{event.hour:<3} {event.minute:<3} {event.second:<8} "
+                f"{event.latitude:<10} {event.longitude:<10} {event.depth:<4} 8.4 25.6 {event.magnitude:<3} MB\n"
             )
 
     print(f"Deleted {deleted_events} event(s) because SAC files were less than 5")
@@ -132,39 +119,41 @@ def main():
     m = 0  # Counter for deleted events
     all_sac = 0
     left_event = 0
-    updated_event_lines = []
+    updated_events = []
 
-    # Process each event
-    for line in events:
-        event_info = line.split()
-        event_dir = event_info[0]
+    # Index of the SAC headers (no waveforms); only files added or changed
+    # since the last run are read, in parallel
+    trace_index = TraceIndex("log/trace_index.sqlite")
+    trace_index.sync("local_vel_data")
 
+    # Process each event
+    for i, event_dir in enumerate(events.names):
         continue_processing, n_sac = process_event_directory(
-            event_dir, event_info, station_flag
+            event_dir, event_dir, station_flag, trace_index
         )
         if not continue_processing:
             m += 1
             continue
 
-        updated_event_lines.append(line)
-        os.chdir("../../")
+        updated_events.append(i)
         all_sac += n_sac
         left_event += 1
 
     # Sort and print station data
-    station_data_sorted = sorted(station_data, key=lambda x: x.name, reverse=True)
+    stations = station_table(station_data)
+    station_data_sorted = stations[np.argsort(stations["name"], kind="stable")[::-1]]
     print(f"Total station count: {len(station_data_sorted)}")
 
     # Write station data if needed
     if station_flag:
         with open("log/NAFZ_stats.txt", "w") as outfile:
-            for station in station_data_sorted:
+            for station in records(station_data_sorted, StationRecord):
                 outfile.write(
-                    f"{station.name:<10} {station.lon:<8.4f} {station.lat:<8.4f} {station.dep:<3.1f}\n"
+                    f"{station.name:<10} {station.longitude:<8.4f} {station.latitude:<8.4f} {station.elevation:<3.1f}\n"
                 )
 
     # Write updated event parameter files
-    write_updated_event_par_files(updated_event_lines, all_sac, left_event, m)
+    write_updated_event_par_files(events, updated_events, all_sac, left_event, m)
 
 
 if __name__ == "__main__":
@@ -1,83 +1,97 @@
 ###############################################################################
 # Description:
-# This script sets the theoretical P and S wave arrival times for SAC files.
+# This script sets the theoretical P and S wave arrival times for SAC files
+# (in-process TauP, nafz.travel_times).
+# kt1/kt2 hold the phase of the first arrival, "p"/"P" and "s"/"S" (the
+# up-going p/s for most local events), not always "P"/"S" as with Java taup:
+# later checks should test t1/t2 rather than kt1 == "P".
 # It prepares SAC files for further AI-based picking methods like PhaseNet.
 # It specifically handles BHZ, BHN, and BHE components.
 ###############################################################################
 import os
-import glob
 import subprocess
 import shutil
 import csv
 import re
 import datetime
+import logging
+from nafz.catalog_index import CatalogIndex
+from nafz.trace_index import TraceIndex
+from nafz.travel_times import set_event_arrivals
 ###############################################################################
-def parse_sac_filename(filename):
-    pattern = r'(\d{4}\.\d{3}\.\d{2}\.\d{2}\.\d{2}\.\d{3})\.([^.]+)\.([^.]+)\.\.(BH[ZNE])\.SAC'
-    match = re.match(pattern, filename)
-    if match:
-        timestamp, network, station, channel = match.groups()
-        # Skip KO network files
-        if network == "KO":
-            return None
-        return timestamp, network, station, channel
-    return None
+# Velocity model of the theoretical arrivals: "prem" as taup setsac used, any
+# other obspy TauP model, or a local crust of nafz.travel_time_table
+# ("example_layered" there is an illustrative placeholder, not a NAFZ model)
+travel_time_model = "prem"
 
 def process_events(base_dir, cap_sac_dir):
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    with open(os.path.join(script_dir, "log", "Poyraz_2015_catlog_updated.par"), "r") as elf:
-        event_lines = elf.read().splitlines()
+    catalog = CatalogIndex.load(os.path.join(script_dir, "log", "Poyraz_2015_catlog_updated.par"))
 
     os.makedirs(cap_sac_dir, exist_ok=True)
 
-    processed_stations = set()
+    # SAC files and channels from the trace index (headers re-read only for
+    # files changed since 3_delete_less_5.py)
+    dataset = os.path.basename(base_dir)
+    trace_index = TraceIndex(os.path.join(script_dir, "log", "trace_index.sqlite"))
+    trace_index.sync(dataset, catalog.names)
 
-    for line in event_lines:
-        event = line.split()
-        event_dir = event[0]
+    processed_stations = set()
 
+    event_files = {}
+    for event_dir in catalog.names:
         event_path = os.path.join(base_dir, event_dir)
         if not os.path.isdir(event_path):
             print(f"The records of {event_dir} have been deleted ordo not exist, skipping.")
             continue
 
         # Filter out KO network files
-        sac_files = [f for f in glob.glob(os.path.join(event_path, "*.SAC")) if not os.path.basename(f).split('.')[6] == 'KO']
+        rows = trace_index.traces(dataset, event=event_dir, exclude_networks=("KO",))
+        sac_files = [trace_index.full_path(row["path"]) for row in rows]
         
         if not sac_files:
             print(f"No valid SAC files found in {event_dir} (excluding KO network), skipping.")
             continue
+        event_files[event_dir] = rows
+
+    # Theoretical P (t1) and S (t2) arrivals of travel_time_model, events in
+    # parallel, instead of `taup setsac -mod prem -evdpkm -ph P-1,S-2`: looked
+    # up in the distance x depth table of the model (nafz.travel_time_table,
+    # built on the first run into .cache/travel_times), exact TauP outside it
+    event_paths = {
+        event_dir: [trace_index.full_path(row["path"]) for row in rows] for event_dir, rows in event_files.items()
+    }
+    for event_dir, missing in set_event_arrivals(event_paths, model=travel_time_model, table=True):
+        if missing:
+            print(f"Error processing SAC files in {event_dir}: no event depth or distance in {len(missing)} file(s)")
+        else:
+            print(f"Processed SAC files in {event_dir}.")
+        trace_index.add_files(event_paths[event_dir])
 
-        try:
-            subprocess.run(
-                ["taup", "setsac", "-mod", "prem", "-evdpkm", "-ph", "P-1,S-2"] + sac_files,
-                check=True
+    for event_dir, rows in event_files.items():
+        complete = {
+            (network, station): paths
+            for _, network, station, paths in trace_index.complete_stations(
+                dataset, event=event_dir, channels=('BHZ', 'BHN', 'BHE'), exclude_networks=("KO",)
             )
-            print(f"Processed SAC files in {event_dir}.")
-        except subprocess.CalledProcessError as e:
-            print(f"Error processing SAC files in {event_dir}: {e}")
-
-        station_files = {}
-        for sac_file in sac_files:
-            parsed = parse_sac_filename(os.path.basename(sac_file))
-            if parsed:
-                timestamp, network, station, channel = parsed
-                if channel in ['BHZ', 'BHN', 'BHE']:
-                    key = f"{timestamp}.{network}.{station}"
-                    if key not in station_files:
-                        station_files[key] = []
-                    station_files[key].append((sac_file, channel))
-
-        for key, files in station_files.items():
-            if len(files) == 3 and set(channel for _, channel in files) == {'BHZ', 'BHN', 'BHE'}:
-                for sac_file, _ in files:
-                    dest_path = os.path.join(cap_sac_dir, os.path.basename(sac_file))
-                    shutil.copy2(sac_file, dest_path)
-                    print(f"Copied: {os.path.basename(sac_file)}")
-                processed_stations.add(f"{key}.BH*")
-            else:
+        }
+        # {timestamp}.{network}.{station} part of the file names
+        station_keys = {
+            (row["network"], row["station"]): ".".join(os.path.basename(row["path"]).split('.')[:8])
+            for row in rows
+        }
+        for (network, station), key in sorted(station_keys.items()):
+            paths = complete.get((network, station))
+            if paths is None:
                 print(f"Station {key} does not have all three components (BHZ, BHN, BHE), skipping.")
-
+                continue
+            for sac_file in map(trace_index.full_path, paths.values()):
+                dest_path = os.path.join(cap_sac_dir, os.path.basename(sac_file))
+                shutil.copy2(sac_file, dest_path)
+                print(f"Copied: {os.path.basename(sac_file)}")
+            processed_stations.add(f"{key}.BH*")
+
+    trace_index.close()
     return processed_stations
 
 def rename_sac_files(directory):
@@ -139,6 +153,8 @@ def run_phasenet(data_list, data_dir, result_dir):
     subprocess.run(command, check=True)
 
 def main():
+    # Progress of nafz (e.g. building the travel-time table on the first run)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     base_directory = os.path.abspath("local_vel_data")  # Base path for event directories
     cap_sac_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "NAFZ_4Pick_3SAC")
     output_csv = os.path.join(cap_sac_dir, "sac.csv")
@@ -0,0 +1,104 @@
+###############################################################################
+# Description:
+# Download throughput benchmark of nafz.download.DownloadScheduler against the
+# offline FDSN stand-in (nafz.fake_fdsn), for several concurrency settings,
+# with and without the campaign-wide availability cache.
+# Run from the repository root: python benchmarks/bench_download.py
+# Options: --events 24 --stations 12 --latency 0.05 --failure-rate 0.05
+###############################################################################
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from obspy import UTCDateTime
+from obspy.clients.fdsn.mass_downloader import RectangularDomain, Restrictions
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nafz.download import MASS_DOWNLOADER_LOGGER, DownloadScheduler
+from nafz.fake_fdsn import FakeFDSNServer
+
+###############################################################################
+MINLAT, MAXLAT, MINLON, MAXLON = 40.00, 41.20, 29.60, 31.00
+CAMPAIGN_START = UTCDateTime("2013-01-01")
+
+
+def make_requests(n_events, root, pre_s=30, aft_s=150):
+    domain = RectangularDomain(minlatitude=MINLAT, maxlatitude=MAXLAT,
+                               minlongitude=MINLON, maxlongitude=MAXLON)
+    requests = []
+    for i in range(n_events):
+        origin = CAMPAIGN_START + i * 3600
+        name = origin.strftime("%Y%m%d%H%M%S")
+        restrictions = Restrictions(
+            starttime=origin - pre_s,
+            endtime=origin + aft_s,
+            reject_channels_with_gaps=True,
+            minimum_length=0.90,
+            channel_priorities=["BH[ENZ]"],
+            location_priorities=["", "00", "10"],
+        )
+        mseed_storage = os.path.join(root, "data", name)
+        stationxml_storage = os.path.join(root, "response", name)
+        requests.append((name, domain, restrictions, mseed_storage, stationxml_storage))
+    return requests
+
+
+def run_case(server, args, max_workers, provider_limit, cached):
+    root = tempfile.mkdtemp(prefix="bench_download_")
+    try:
+        window = (CAMPAIGN_START - 86400, CAMPAIGN_START + (args.events + 1) * 3600) if cached else None
+        scheduler = DownloadScheduler(
+            providers=[server.url],
+            provider_limits={server.url: provider_limit},
+            max_workers=max_workers,
+            retries=3,
+            backoff=0.1,
+            threads_per_client=3,
+            availability_window=window,
+            client_kwargs={"_discover_services": False},
+        )
+        server.reset_stats()
+        t0 = time.perf_counter()
+        results = scheduler.run(make_requests(args.events, root), progress=False)
+        elapsed = time.perf_counter() - t0
+        nbytes = sum(r.bytes for r in results)
+        failed = sum(r.status == "failed" for r in results)
+        station = server.stats.get("station", {})
+        dataselect = server.stats.get("dataselect", {})
+        print(f"{max_workers:>8} {provider_limit:>6} {'yes' if cached else 'no':>7} {elapsed:>9.2f} "
+              f"{args.events / elapsed * 60:>11.1f} {nbytes / elapsed / 1024:>9.1f} "
+              f"{station.get('requests', 0):>8} {dataselect.get('requests', 0):>11} "
+              f"{station.get('failures', 0) + dataselect.get('failures', 0):>6} {failed:>7}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download throughput against nafz.fake_fdsn")
+    parser.add_argument("--events", type=int, default=24)
+    parser.add_argument("--stations", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per request")
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    args = parser.parse_args()
+    # MassDownloader logs every request; keep the benchmark table readable
+    MASS_DOWNLOADER_LOGGER.addHandler(logging.NullHandler())
+    MASS_DOWNLOADER_LOGGER.propagate = False
+    logging.getLogger("nafz.download").setLevel(logging.ERROR)
+
+    with FakeFDSNServer(n_stations=args.stations, latency=args.latency,
+                        failure_rate=args.failure_rate,
+                        bounds=(MINLON, MINLAT, MAXLON, MAXLAT)) as server:
+        print(f"{args.events} events, {args.stations} stations, latency {args.latency} s, "
+              f"failure rate {args.failure_rate:.0%}")
+        print(f"{'workers':>8} {'limit':>6} {'cached':>7} {'time [s]':>9} {'events/min':>11} "
+              f"{'KiB/s':>9} {'station':>8} {'dataselect':>11} {'503s':>6} {'failed':>7}")
+        for max_workers, provider_limit in ((1, 1), (2, 2), (4, 4), (8, 8)):
+            run_case(server, args, max_workers, provider_limit, cached=False)
+        run_case(server, args, 8, 8, cached=True)
+
+
+if __name__ == "__main__":
+    main()
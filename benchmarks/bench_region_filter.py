@@ -0,0 +1,70 @@
+###############################################################################
+# Description:
+# Benchmark of the vectorized region filter (nafz.region) against the
+# row-wise DataFrame.apply + shapely Point path used by 0_Poyraz_2015_catlog.py
+# Run from the repository root: python benchmarks/bench_region_filter.py
+###############################################################################
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point, Polygon, MultiPolygon
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nafz.region import region_mask
+
+###############################################################################
+polygon = Polygon([
+    (29.6, 40.0), (29.6, 41.2), (31.0, 41.2), (31.0, 40.0)
+])
+
+regions = {
+    "DANA": polygon,
+    "NAFZ": MultiPolygon([
+        Polygon([(29.95, 40.25), (30.7, 40.25), (30.7, 41.0), (29.95, 41.0)]),
+        Polygon([(31.5, 40.5), (32.5, 40.5), (32.5, 41.0), (31.5, 41.0)]),
+    ]),
+}
+
+
+def synthetic_catalog(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Latitude": rng.uniform(39.0, 42.0, n),
+        "Longitude": rng.uniform(28.0, 33.0, n),
+    })
+
+
+def rowwise_mask(data):
+    def is_inside_polygon(lat, lon):
+        point = Point(lon, lat)
+        return polygon.contains(point)
+
+    return data.apply(lambda row: is_inside_polygon(row["Latitude"], row["Longitude"]), axis=1).to_numpy()
+
+
+def timed(func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t0
+
+
+def main():
+    print(f"{'events':>10} {'row-wise [s]':>14} {'vectorized [s]':>16} {'speed-up':>10}")
+    for n in (1_000, 10_000, 100_000):
+        data = synthetic_catalog(n)
+        slow, t_slow = timed(rowwise_mask, data)
+        fast, t_fast = timed(region_mask, data["Latitude"], data["Longitude"], polygon)
+        assert np.array_equal(slow, fast)
+        print(f"{n:>10} {t_slow:>14.4f} {t_fast:>16.4f} {t_slow / t_fast:>9.0f}x")
+
+    # Vectorized path only: multi-million events against several named regions
+    for n in (1_000_000, 5_000_000):
+        data = synthetic_catalog(n)
+        _, t_fast = timed(region_mask, data["Latitude"], data["Longitude"], regions)
+        print(f"{n:>10} {'-':>14} {t_fast:>16.4f} {'(2 regions)':>10}")
+
+
+if __name__ == "__main__":
+    main()
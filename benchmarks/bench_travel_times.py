@@ -0,0 +1,58 @@
+###############################################################################
+# Description:
+# Benchmark and accuracy check of the travel-time tables (nafz.travel_time_table)
+# against exact in-process TauP (nafz.travel_times), for prem and the
+# illustrative example_layered crust, over the local range of the campaign
+# (2-100 km, depth <= 15 km). The first run builds the tables into
+# .cache/travel_times (a few minutes).
+# Run from the repository root: python benchmarks/bench_travel_times.py
+###############################################################################
+import logging
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nafz.travel_time_table import check_table, travel_time_table
+
+###############################################################################
+MIN_DEG, MAX_DEG = 2 / 111.19, 100 / 111.19
+MAX_DEPTH = 15.0
+
+
+def local_pairs(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(MIN_DEG, MAX_DEG, n), rng.uniform(0.0, MAX_DEPTH, n)
+
+
+def timed(func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t0
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    for model in ("prem", "example_layered"):
+        table, t_load = timed(travel_time_table, model)
+        print(f"{model}: table {table.times['P'].shape} loaded/built in {t_load:.1f} s")
+
+        distances, depths = local_pairs(200)
+        _, t_exact = timed(table.exact().first_arrivals, distances, depths)
+        print(f"{'arrivals':>10} {'exact TauP [s]':>16} {'table [s]':>12} {'speed-up':>10}")
+        _, t_table = timed(table.first_arrivals, distances, depths)
+        print(f"{200:>10} {t_exact:>16.4f} {t_table:>12.5f} {t_exact / t_table:>9.0f}x")
+        for n in (100_000, 1_000_000, 5_000_000):
+            _, t_table = timed(table.first_arrivals, *local_pairs(n))
+            print(f"{n:>10} {t_exact / 200 * n:>15.0f}* {t_table:>12.5f} {t_exact / 200 * n / t_table:>9.0f}x")
+        print("* extrapolated from 200 arrivals")
+
+        errors = check_table(table, n=500, max_distance=MAX_DEG, max_depth=MAX_DEPTH)
+        for pick, (max_error, rms_error) in errors.items():
+            print(f"{pick}: max error {max_error * 1000:.1f} ms, RMS {rms_error * 1000:.1f} ms (500 points)")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+###############################################################################
+# Description:
+# Continuous-archive download mode. Instead of one small FDSN request per
+# event window, the event windows are either
+#   coalesced  overlapping / nearby windows merged into longer requests, or
+#   day        one day-long continuous request per day that has events,
+# downloaded once into an archive directory, and the per-event windows are then
+# cut locally into data/<event_dir>/ with the file names the mass downloader
+# would have used (NET.STA.LOC.CHA__START__END.mseed).
+###############################################################################
+import glob
+import os
+from collections import namedtuple
+from obspy import UTCDateTime, read
+
+###############################################################################
+STRFTIME = "%Y%m%dT%H%M%SZ"
+
+# One event window and one archive request covering several event windows
+EventWindow = namedtuple("EventWindow", ["name", "starttime", "endtime"])
+Segment = namedtuple("Segment", ["name", "starttime", "endtime", "windows"])
+
+
+def event_windows(events, pre_event_s, aft_event_s):
+    # events: EventRecords of the catalog
+    windows = []
+    for event in events:
+        origin_time = UTCDateTime(f"{event.ymd} {event.hour}:{event.minute}:{event.second}")
+        windows.append(EventWindow(event.name, origin_time - pre_event_s, origin_time + aft_event_s))
+    return sorted(windows, key=lambda w: w.starttime)
+
+
+def _segment(starttime, endtime, windows):
+    name = f"{starttime.strftime(STRFTIME)}__{endtime.strftime(STRFTIME)}"
+    return Segment(name, starttime, endtime, windows)
+
+
+def coalesce_windows(windows, max_gap_s=0.0, max_length_s=3600.0):
+    # Merge time-sorted windows that overlap or are at most max_gap_s apart,
+    # as long as the merged request stays within max_length_s
+    segments = []
+    current = []
+    for window in sorted(windows, key=lambda w: w.starttime):
+        if current:
+            start = current[0].starttime
+            end = max(w.endtime for w in current)
+            if window.starttime - end <= max_gap_s and max(end, window.endtime) - start <= max_length_s:
+                current.append(window)
+                continue
+            segments.append(_segment(start, end, current))
+        current = [window]
+    if current:
+        segments.append(_segment(current[0].starttime, max(w.endtime for w in current), current))
+    return segments
+
+
+def day_segments(windows):
+    # One UTC day per segment; windows crossing midnight extend their day
+    days = {}
+    for window in windows:
+        days.setdefault(window.starttime.date, []).append(window)
+    segments = []
+    for date in sorted(days):
+        members = days[date]
+        day = UTCDateTime(date)
+        end = max(day + 86400, max(w.endtime for w in members))
+        segments.append(_segment(day, end, members))
+    return segments
+
+
+def segment_files(segment, archive_dir):
+    pattern = f"*__{segment.starttime.strftime(STRFTIME)}__{segment.endtime.strftime(STRFTIME)}.mseed"
+    return sorted(glob.glob(os.path.join(archive_dir, pattern)))
+
+
+def cut_event_windows(segment, archive_dir, data_root="data", minimum_length=0.9, reject_gaps=True):
+    # Cut every event window of the segment out of the archived traces.
+    # Returns (files written, windows rejected for gaps or short data).
+    written = rejected = 0
+    for path in segment_files(segment, archive_dir):
+        st = read(path)
+        head = st[0].stats
+        for window in segment.windows:
+            out = os.path.join(
+                data_root,
+                window.name,
+                f"{head.network}.{head.station}.{head.location}.{head.channel}"
+                f"__{window.starttime.strftime(STRFTIME)}__{window.endtime.strftime(STRFTIME)}.mseed",
+            )
+            if os.path.exists(out):
+                continue
+            cut = st.slice(window.starttime, window.endtime)
+            if not len(cut):
+                continue
+            if reject_gaps and len(cut) > 1:
+                rejected += 1
+                continue
+            covered = sum(tr.stats.endtime - tr.stats.starttime for tr in cut)
+            if covered < minimum_length * (window.endtime - window.starttime):
+                rejected += 1
+                continue
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            cut.write(out, format="MSEED")
+            written += 1
+    return written, rejected
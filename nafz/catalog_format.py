@@ -0,0 +1,84 @@
+###############################################################################
+# Description:
+# Single-pass writer for the catalog products of 0_Poyraz_2015_catlog.py:
+#   *.csv  the filtered catalog
+#   *.txt  the declustered catalog in our group's comma separated format
+#   *.par  the declustered event list read by every later pipeline stage
+# All outputs are built from the filtered DataFrame in memory with vectorized
+# datetime and string operations, nothing is re-read or re-parsed.
+###############################################################################
+import numpy as np
+import pandas as pd
+from nafz.decluster import decluster
+
+###############################################################################
+def _fmt(values):
+    # Same text as csv.writer / str() gives for the individual values
+    return pd.Series(values).astype(str).reset_index(drop=True)
+
+
+def format_txt_lines(events):
+    # Our custom catlog format following our group tradition
+    # Change and replace the placeholders if you want
+    times = np.datetime_as_string(events["Time"].to_numpy("datetime64[ms]"), unit="ms")
+    return (
+        "xxxxx,"
+        + pd.Series(np.char.replace(times, "T", " "))
+        + "," + _fmt(events["Latitude"])
+        + "," + _fmt(events["Longitude"])
+        + "," + _fmt(events["Depth"])
+        + ",xxxx,yyyyy,"
+        + _fmt(events["Magnitude_type"])
+        + "," + _fmt(events["Magnitude"])
+        + ", "
+    )
+
+
+def format_par_lines(events):
+    # Event name, date, hour, minute, second, lat, lon, depth and magnitude
+    # Our custom catlog format following our group tradition
+    times = pd.Series(np.datetime_as_string(events["Time"].to_numpy("datetime64[ms]"), unit="ms"))
+    ymd = times.str[0:4] + times.str[5:7] + times.str[8:10]
+    h = times.str[11:13]
+    m = times.str[14:16]
+    s = times.str[17:23]
+    name = ymd + "." + h + "." + m
+    return (
+        name.str.ljust(11)
+        + " " + ymd.str.ljust(9)
+        + " " + h.str.ljust(3)
+        + " " + m.str.ljust(3)
+        + " " + s.str.ljust(8)
+        + " " + _fmt(events["Latitude"]).str.ljust(10)
+        + " " + _fmt(events["Longitude"]).str.ljust(10)
+        + " " + _fmt(events["Depth"]).str.ljust(4)
+        + "  8.4 25.6   "
+        + _fmt(events["Magnitude"]).str.rjust(3)
+        + "  ML"
+    )
+
+
+def _write_lines(path, lines, terminator="\n"):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        if len(lines):
+            f.write(terminator.join(lines) + terminator)
+
+
+def write_catalog_outputs(data, csv_file, txt_file, par_file, method="time_gap", **options):
+    # data holds Time (datetime64), Latitude, Longitude, Depth, Magnitude and
+    # Magnitude_type. The TXT and PAR catalogs only hold the events kept by the
+    # declustering strategy (see nafz.decluster). Returns those events.
+    data = data.sort_values(by="Time", kind="stable").reset_index(drop=True)
+
+    # Filtered catalog, comma separated
+    out = data.copy()
+    out["Time"] = (
+        np.datetime_as_string(data["Time"].to_numpy("datetime64[us]"), unit="us") + "Z"
+    )
+    out.to_csv(csv_file, index=False, sep=",")
+
+    # Declustered events, most recent first
+    kept = data[decluster(data, method, **options)].iloc[::-1].reset_index(drop=True)
+    _write_lines(txt_file, format_txt_lines(kept), terminator="\r\n")
+    _write_lines(par_file, format_par_lines(kept))
+    return kept
@@ -0,0 +1,192 @@
+###############################################################################
+# Description:
+# Persistent spatio-temporal index of the .par event catalog, e.g.
+#     catalog = CatalogIndex.load("catlog/Poyraz_2015_catlog.par")
+#     for i in catalog.query(start="2013-01-01", bbox=(29.9, 40.5, 30.7, 41.0),
+#                            magnitude=(1.5, None), depth=(None, 10.0)):
+#         event = catalog.event(i)
+# Events keep the catalog (file) order. Time queries use a sorted time array,
+# spatial queries a KD-tree on (lon, lat). The index is pickled under .cache/
+# next to the .par file and rebuilt only when the .par file changes.
+###############################################################################
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from nafz.catalog_io import cache_is_valid, cache_paths, write_cache_key
+from nafz.records import EventRecord, event_table
+from nafz.region import region_mask
+
+###############################################################################
+# Below this many candidates a linear scan beats the KD-tree
+TREE_MIN_CANDIDATES = 2048
+# Bumped whenever the pickled layout of CatalogIndex changes
+INDEX_VERSION = 2
+
+
+def _as_datetime64(value):
+    # Accept strings, datetime, pandas/numpy times and obspy UTCDateTime
+    value = pd.Timestamp(getattr(value, "datetime", value))
+    if value.tzinfo is not None:
+        value = value.tz_convert(None)
+    return value.to_datetime64().astype("datetime64[ms]")
+
+
+def _between(values, limits):
+    # limits is (min, max), either may be None
+    low, high = limits
+    mask = np.ones(values.shape, dtype=bool)
+    if low is not None:
+        mask &= values >= low
+    if high is not None:
+        mask &= values <= high
+    return mask
+
+
+class CatalogIndex:
+    # The events live in one structured array (nafz.records.EVENT_DTYPE);
+    # times, latitude, ... are zero-copy views of its fields
+    def __init__(self, names, times, latitude, longitude, depth, magnitude):
+        self.version = INDEX_VERSION
+        self.table = event_table(names, times, latitude, longitude, depth, magnitude)
+
+        self._order = np.argsort(self.times, kind="stable")
+        self._rank = np.empty_like(self._order)
+        self._rank[self._order] = np.arange(self._order.size)
+        self._sorted_times = self.times[self._order]
+        self._tree = cKDTree(np.column_stack((self.longitude, self.latitude))) if len(self) else None
+
+    def __len__(self):
+        return self.table.size
+
+    @property
+    def names(self):
+        return np.char.decode(self.table["name"], "ascii")
+
+    @property
+    def times(self):
+        return self.table["time"]
+
+    @property
+    def latitude(self):
+        return self.table["latitude"]
+
+    @property
+    def longitude(self):
+        return self.table["longitude"]
+
+    @property
+    def depth(self):
+        return self.table["depth"]
+
+    @property
+    def magnitude(self):
+        return self.table["magnitude"]
+
+    @classmethod
+    def from_par(cls, path):
+        # Parse a .par catalog (name ymd hour min sec lat lon depth ... mag type)
+        par = pd.read_csv(path, sep=r"\s+", header=None, dtype=str)
+        times = (
+            pd.to_datetime(par[1], format="%Y%m%d")
+            + pd.to_timedelta(par[2].astype(int), unit="h")
+            + pd.to_timedelta(par[3].astype(int), unit="m")
+            + pd.to_timedelta(par[4].astype(float).mul(1000).round(), unit="ms")
+        )
+        return cls(
+            par[0].to_numpy(),
+            times.to_numpy(),
+            par[5].astype(float).to_numpy(),
+            par[6].astype(float).to_numpy(),
+            par[7].astype(float).to_numpy(),
+            par[10].astype(float).to_numpy(),
+        )
+
+    @classmethod
+    def load(cls, path, cache_dir=None):
+        # Load the pickled index, rebuilding it when the .par file changed
+        index_path, key_path = cache_paths(path, cache_dir, suffix=".index.pkl")
+        if cache_is_valid(path, index_path, key_path):
+            with open(index_path, "rb") as f:
+                index = pickle.load(f)
+            if getattr(index, "version", None) == INDEX_VERSION:
+                return index
+
+        index = cls.from_par(path)
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with open(index_path + ".tmp", "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(index_path + ".tmp", index_path)
+        write_cache_key(path, key_path)
+        return index
+
+    def event(self, i):
+        return EventRecord(self.table, i)
+
+    def events(self, indices=None):
+        if indices is None:
+            indices = range(len(self))
+        for i in indices:
+            yield self.event(i)
+
+    def to_frame(self, indices=None):
+        # Events as a DataFrame with the columns used by nafz.catalog_format
+        if indices is None:
+            indices = slice(None)
+        return pd.DataFrame({
+            "Name": np.char.decode(self.table["name"][indices], "ascii"),
+            "Time": self.times[indices],
+            "Latitude": self.latitude[indices],
+            "Longitude": self.longitude[indices],
+            "Depth": self.depth[indices],
+            "Magnitude": self.magnitude[indices],
+        })
+
+    def query(self, start=None, end=None, bbox=None, polygon=None, magnitude=None, depth=None):
+        # Indices (in catalog order) of the events with start <= time <= end,
+        # inside bbox = (minlon, minlat, maxlon, maxlat) and / or a shapely
+        # polygon, and with magnitude / depth within (min, max) limits
+        lo, hi = 0, len(self)
+        if start is not None:
+            lo = np.searchsorted(self._sorted_times, _as_datetime64(start), side="left")
+        if end is not None:
+            hi = np.searchsorted(self._sorted_times, _as_datetime64(end), side="right")
+        if hi <= lo:
+            return np.empty(0, dtype=np.int64)
+
+        if polygon is not None:
+            px0, py0, px1, py1 = polygon.bounds
+            if bbox is not None:
+                bbox = (max(bbox[0], px0), max(bbox[1], py0), min(bbox[2], px1), min(bbox[3], py1))
+            else:
+                bbox = (px0, py0, px1, py1)
+
+        if bbox is not None and hi - lo > TREE_MIN_CANDIDATES:
+            minlon, minlat, maxlon, maxlat = bbox
+            if minlon > maxlon or minlat > maxlat:
+                return np.empty(0, dtype=np.int64)
+            center = ((minlon + maxlon) / 2.0, (minlat + maxlat) / 2.0)
+            radius = max(maxlon - minlon, maxlat - minlat) / 2.0
+            candidates = np.asarray(self._tree.query_ball_point(center, radius, p=np.inf), dtype=np.int64)
+            rank = self._rank[candidates]
+            candidates = candidates[(rank >= lo) & (rank < hi)]
+        else:
+            candidates = self._order[lo:hi]
+
+        if bbox is not None:
+            minlon, minlat, maxlon, maxlat = bbox
+            candidates = candidates[
+                _between(self.longitude[candidates], (minlon, maxlon))
+                & _between(self.latitude[candidates], (minlat, maxlat))
+            ]
+        if polygon is not None:
+            candidates = candidates[
+                region_mask(self.latitude[candidates], self.longitude[candidates], polygon)
+            ]
+        if magnitude is not None:
+            candidates = candidates[_between(self.magnitude[candidates], magnitude)]
+        if depth is not None:
+            candidates = candidates[_between(self.depth[candidates], depth)]
+        return np.sort(candidates)
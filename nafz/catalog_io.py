@@ -0,0 +1,152 @@
+###############################################################################
+# Description:
+# Ingestion of the original text catalog (Poyraz et al., 2015 format):
+#     Date        Time      Latit(N)  Long(E) Depth(km)  ML
+#     08.05.2012  15:51:55  40.4938   30.3148   11.2      1.6
+# The text file is parsed in chunks into a typed columnar cache (Parquet)
+# under .cache/ next to the source. The cache is keyed on the size, mtime and SHA-256 of the
+# source, so reruns and downstream scripts only pay for reading the Parquet.
+###############################################################################
+import hashlib
+import json
+import os
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # no cache without pyarrow, fall back to parsing the text
+    pa = pq = None
+
+###############################################################################
+RAW_COLUMNS = ["Date", "Time", "Latitude", "Longitude", "Depth", "Magnitude"]
+RAW_DTYPES = {
+    "Date": str,
+    "Time": str,
+    "Latitude": "float64",
+    "Longitude": "float64",
+    "Depth": "float64",
+    "Magnitude": "float64",
+}
+TIME_FORMAT = "%d.%m.%Y %H:%M:%S"
+CACHE_VERSION = 1
+
+
+def file_sha256(path, block_size=1 << 20):
+    # Stream the file through SHA-256 without loading it into memory
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def cache_paths(path, cache_dir=None, suffix=".parquet"):
+    # Cached artifact and key file for a given source file
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), ".cache")
+    name = os.path.basename(path)
+    return os.path.join(cache_dir, f"{name}{suffix}"), os.path.join(cache_dir, f"{name}{suffix}.json")
+
+
+def _source_key(path, sha256=None):
+    stat = os.stat(path)
+    return {
+        "version": CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256 if sha256 is not None else file_sha256(path),
+    }
+
+
+def write_cache_key(path, key_path, sha256=None):
+    with open(key_path, "w") as f:
+        json.dump(_source_key(path, sha256), f)
+
+
+def cache_is_valid(path, artifact_path, key_path):
+    # Size and mtime are checked first; the hash is only recomputed when the
+    # file was touched, so an unchanged source never gets read again
+    if not (os.path.exists(artifact_path) and os.path.exists(key_path)):
+        return False
+    with open(key_path, "r") as f:
+        key = json.load(f)
+    stat = os.stat(path)
+    if key.get("version") != CACHE_VERSION or key.get("size") != stat.st_size:
+        return False
+    if key.get("mtime_ns") == stat.st_mtime_ns:
+        return True
+    if key.get("sha256") != file_sha256(path):
+        return False
+    write_cache_key(path, key_path, key["sha256"])
+    return True
+
+
+def parse_catalog_chunks(path, chunksize=500_000):
+    # Yield typed DataFrames (Time, Latitude, Longitude, Depth, Magnitude)
+    reader = pd.read_csv(
+        path,
+        sep=r"\s+",
+        header=None,
+        skiprows=1,
+        names=RAW_COLUMNS,
+        dtype=RAW_DTYPES,
+        chunksize=chunksize,
+    )
+    for chunk in reader:
+        chunk["Time"] = pd.to_datetime(chunk["Date"] + " " + chunk["Time"], format=TIME_FORMAT)
+        yield chunk.drop(columns="Date").reset_index(drop=True)
+
+
+def build_catalog_cache(path, cache_dir=None, chunksize=500_000):
+    # Parse the text catalog chunk by chunk into one Parquet row group per chunk
+    parquet_path, key_path = cache_paths(path, cache_dir)
+    os.makedirs(os.path.dirname(parquet_path), exist_ok=True)
+
+    tmp_path = parquet_path + ".tmp"
+    writer = None
+    try:
+        for chunk in parse_catalog_chunks(path, chunksize):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:  # empty catalog, keep the typed schema
+        empty = pd.DataFrame({
+            "Time": pd.Series(dtype="datetime64[ns]"),
+            **{name: pd.Series(dtype="float64") for name in RAW_COLUMNS[2:]},
+        })
+        pq.write_table(pa.Table.from_pandas(empty, preserve_index=False), tmp_path)
+
+    os.replace(tmp_path, parquet_path)
+    write_cache_key(path, key_path)
+    return parquet_path
+
+
+def _cached_parquet(path, cache_dir=None, chunksize=500_000):
+    parquet_path, key_path = cache_paths(path, cache_dir)
+    if not cache_is_valid(path, parquet_path, key_path):
+        build_catalog_cache(path, cache_dir, chunksize)
+    return parquet_path
+
+
+def read_catalog(path, columns=None, cache_dir=None, chunksize=500_000):
+    # Load the whole catalog, building or refreshing the cache if needed
+    if pq is None:
+        data = pd.concat(parse_catalog_chunks(path, chunksize), ignore_index=True)
+        return data if columns is None else data[columns]
+    return pd.read_parquet(_cached_parquet(path, cache_dir, chunksize), columns=columns)
+
+
+def iter_catalog(path, columns=None, batch_size=500_000, cache_dir=None):
+    # Stream the catalog in batches, for catalogs larger than memory
+    if pq is None:
+        for chunk in parse_catalog_chunks(path, batch_size):
+            yield chunk if columns is None else chunk[columns]
+        return
+    parquet = pq.ParquetFile(_cached_parquet(path, cache_dir, batch_size))
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas()
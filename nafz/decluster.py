@@ -0,0 +1,187 @@
+###############################################################################
+# Description:
+# Declustering strategies for the event catalog. Every strategy takes a
+# DataFrame with Time, Latitude, Longitude and Magnitude columns and returns a
+# boolean mask (in the DataFrame's row order) of the events to keep.
+#   time_gap         keep an event only if it is >= min_gap after the last
+#                    kept one (our default, 2 minutes)
+#   gardner_knopoff  space-time windows of Gardner & Knopoff (1974)
+#   uhrhammer        space-time windows of Uhrhammer (1986)
+# New strategies can be added with register_strategy.
+###############################################################################
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+###############################################################################
+EARTH_RADIUS_KM = 6371.0
+
+
+def _sorted_times(data):
+    # Event times as int64 nanoseconds and the order that sorts them
+    t = data["Time"].to_numpy("datetime64[ns]").astype(np.int64)
+    order = np.argsort(t, kind="stable")
+    return t[order], order
+
+
+def _unsort(mask_sorted, order):
+    mask = np.empty_like(mask_sorted)
+    mask[order] = mask_sorted
+    return mask
+
+
+def min_gap_mask(times, min_gap=pd.Timedelta(minutes=2)):
+    # Keep an event only if it is at least min_gap after the last kept event.
+    # times must be sorted; next_kept[i] is the first event that may follow i,
+    # so the kept events are the orbit of event 0 under next_kept.
+    t = np.asarray(times, dtype="datetime64[ns]").astype(np.int64)
+    keep = np.zeros(t.size, dtype=bool)
+    if t.size == 0:
+        return keep
+    next_kept = np.searchsorted(t, t + pd.Timedelta(min_gap).value, side="left")
+    i = 0
+    while i < t.size:
+        keep[i] = True
+        i = next_kept[i]
+    return keep
+
+
+def time_gap(data, min_gap=pd.Timedelta(minutes=2)):
+    t, order = _sorted_times(data)
+    return _unsort(min_gap_mask(t.astype("datetime64[ns]"), min_gap), order)
+
+
+###############################################################################
+# Magnitude dependent windows: (distance in km, time in days)
+def gardner_knopoff_window(magnitude):
+    magnitude = np.asarray(magnitude, dtype=np.float64)
+    distance = 10.0 ** (0.1238 * magnitude + 0.983)
+    days = np.where(
+        magnitude >= 6.5,
+        10.0 ** (0.032 * magnitude + 2.7389),
+        10.0 ** (0.5409 * magnitude - 0.547),
+    )
+    return distance, days
+
+
+def uhrhammer_window(magnitude):
+    magnitude = np.asarray(magnitude, dtype=np.float64)
+    return np.exp(-1.024 + 0.804 * magnitude), np.exp(-2.87 + 1.235 * magnitude)
+
+
+def _sphere_xyz(lat, lon):
+    # Cartesian coordinates on the sphere, in km
+    lat, lon = np.radians(lat), np.radians(lon)
+    return EARTH_RADIUS_KM * np.column_stack(
+        (np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat))
+    )
+
+
+def _window_pairs(t, xyz, chord, before_ns, after_ns, block_ns):
+    # Candidate (mainshock, dependent) pairs: j lies within the distance and
+    # time window of i. Events whose window fits into block_ns are searched
+    # with a KD-tree per time block; the few with longer windows use the
+    # sorted time index directly.
+    src, dst = [], []
+    longest = np.maximum(before_ns, after_ns)
+    small = longest <= block_ns
+
+    for start in range(t[0], t[-1] + 1, block_ns):
+        b0, b1 = np.searchsorted(t, [start, start + block_ns], side="left")
+        query = b0 + np.flatnonzero(small[b0:b1])
+        if query.size == 0:
+            continue
+        lo, hi = np.searchsorted(t, [start - block_ns, start + 2 * block_ns], side="left")
+        pairs = cKDTree(xyz[query]).sparse_distance_matrix(
+            cKDTree(xyz[lo:hi]), chord[query].max(), output_type="ndarray"
+        )
+        pairs = pairs[pairs["v"] <= chord[query[pairs["i"]]]]
+        src.append(query[pairs["i"]])
+        dst.append(lo + pairs["j"])
+
+    # |a - b|^2 = 2R^2 - 2 a.b on the sphere, so one dot product per candidate
+    min_dot = EARTH_RADIUS_KM ** 2 - chord ** 2 / 2.0
+    for i in np.flatnonzero(~small):
+        lo = np.searchsorted(t, t[i] - before_ns[i], side="left")
+        hi = np.searchsorted(t, t[i] + after_ns[i], side="right")
+        near = lo + np.flatnonzero(xyz[lo:hi] @ xyz[i] >= min_dot[i])
+        src.append(np.full(near.size, i))
+        dst.append(near)
+
+    if not src:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    src, dst = np.concatenate(src), np.concatenate(dst)
+    dt = t[dst] - t[src]
+    inside = (dt >= -before_ns[src]) & (dt <= after_ns[src]) & (src != dst)
+    return src[inside], dst[inside]
+
+
+def window_decluster(data, window=gardner_knopoff_window, foreshock_fraction=1.0):
+    # Walk the events from the largest magnitude down; every event that is not
+    # yet a dependent becomes a mainshock and claims the smaller events inside
+    # its space-time window. Candidate pairs come from a sorted time index and
+    # KD-trees, so only events with neighbours reach the sequential pass.
+    t, order = _sorted_times(data)
+    dependent = np.zeros(t.size, dtype=bool)
+    if t.size == 0:
+        return ~dependent
+    lat = data["Latitude"].to_numpy(np.float64)[order]
+    lon = data["Longitude"].to_numpy(np.float64)[order]
+    mag = data["Magnitude"].to_numpy(np.float64)[order]
+
+    distance, days = window(mag)
+    chord = 2.0 * EARTH_RADIUS_KM * np.sin(np.minimum(distance / (2.0 * EARTH_RADIUS_KM), np.pi / 2))
+    after_ns = (days * 86400e9).astype(np.int64)
+    before_ns = (foreshock_fraction * days * 86400e9).astype(np.int64)
+    block_ns = max(int(np.quantile(np.maximum(before_ns, after_ns), 0.99)), 1)
+
+    src, dst = _window_pairs(t, _sphere_xyz(lat, lon), chord, before_ns, after_ns, block_ns)
+
+    # Only smaller (later visited) events can be claimed by a mainshock
+    rank = np.empty(t.size, dtype=np.int64)
+    rank[np.argsort(-mag, kind="stable")] = np.arange(t.size)
+    later = rank[dst] > rank[src]
+    src, dst = src[later], dst[later]
+
+    if src.size == 0:
+        return _unsort(~dependent, order)
+    by_rank = np.argsort(rank[src], kind="stable")
+    src, dst = src[by_rank], dst[by_rank]
+    bounds = np.flatnonzero(np.diff(src)) + 1
+    starts = np.concatenate(([0], bounds))
+    stops = np.concatenate((bounds, [src.size]))
+    for i, a, b in zip(src[starts].tolist(), starts.tolist(), stops.tolist()):
+        if not dependent[i]:
+            dependent[dst[a:b]] = True
+
+    return _unsort(~dependent, order)
+
+
+def gardner_knopoff(data, foreshock_fraction=1.0):
+    return window_decluster(data, gardner_knopoff_window, foreshock_fraction)
+
+
+def uhrhammer(data, foreshock_fraction=1.0):
+    return window_decluster(data, uhrhammer_window, foreshock_fraction)
+
+
+###############################################################################
+STRATEGIES = {
+    "time_gap": time_gap,
+    "gardner_knopoff": gardner_knopoff,
+    "uhrhammer": uhrhammer,
+}
+
+
+def register_strategy(name, func):
+    # func(data, **options) -> boolean mask of the events to keep
+    STRATEGIES[name] = func
+
+
+def decluster(data, method="time_gap", **options):
+    # Return the boolean mask of the events kept by the chosen strategy
+    try:
+        strategy = STRATEGIES[method]
+    except KeyError:
+        raise ValueError(f"Unknown declustering method {method!r}, choose from {sorted(STRATEGIES)}")
+    return strategy(data, **options)
@@ -0,0 +1,163 @@
+###############################################################################
+# Description:
+# Instrument-response removal engine equivalent to obspy's
+# Trace.remove_response (zero mean, 5 % cosine taper, pre_filt cosine taper in
+# the frequency domain, water level) with two differences in cost:
+# - the deconvolution spectrum (inverted response x pre_filt taper) is
+#   evaluated once per (response, npts, delta) and kept in an LRU, so traces
+#   of the same channel epoch and length never call evalresp again;
+# - traces of equal length and sampling (the three components of a station)
+#   are deconvolved together in one batched real FFT of a fast length
+#   (scipy.fft.next_fast_len).
+# Responses are taken from trace.stats.response (nafz.response_cache).
+# Several outputs (DISP, VEL, ACC) come from one deconvolution to self.output
+# times a power of i*omega. This equals obspy's remove_response(output=...)
+# only without water level. obspy applies the water level to the response of
+# each output, 60 dB below that response's own maximum. The ACC response of a
+# velocity sensor falls as 1/omega, so obspy clips the upper passband of ACC
+# (11-20 Hz for the 40 Hz synthetic response of nafz.fake_fdsn). ACC derived
+# from VEL is left unclipped there, and deviates from obspy's ACC by up to
+# about 40 % of the peak amplitude (37-42 % measured on that response). DISP
+# derived from VEL matches obspy to rounding. exact=True deconvolves every output with its own water-levelled
+# spectrum (one forward FFT still), which reproduces obspy.
+#     deconvolver = ResponseDeconvolver(output="VEL", pre_filt=[0.8, 1, 20, 22])
+#     failed = deconvolver.remove_response(stream)
+#     done, failed = deconvolver.deconvolve(stream, outputs=("DISP", "VEL", "ACC"))
+###############################################################################
+from collections import OrderedDict
+import numpy as np
+import scipy.fft
+from obspy import Trace
+from obspy.core.inventory import PolynomialResponseStage
+from obspy.signal.invsim import cosine_sac_taper, cosine_taper, invert_spectrum
+from obspy.signal.util import _npts2nfft
+
+###############################################################################
+# Outputs in order of differentiation
+OUTPUTS = ("DISP", "VEL", "ACC")
+
+
+class ResponseDeconvolver:
+    def __init__(self, output="VEL", pre_filt=None, water_level=60, zero_mean=True,
+                 taper=True, taper_fraction=0.05, fast_nfft=True, exact=False, maxsize=256):
+        self.output = output
+        self.pre_filt = tuple(pre_filt) if pre_filt is not None else None
+        self.water_level = water_level
+        self.zero_mean = zero_mean
+        self.taper = taper
+        self.taper_fraction = taper_fraction
+        # fast_nfft=False uses obspy's FFT length, for identical results
+        self.fast_nfft = fast_nfft
+        # exact=True: each output with its own spectrum, as obspy
+        self.exact = exact
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._spectra = OrderedDict()
+        self._tapers = {}
+
+    def nfft(self, npts):
+        # At least 2 * npts to avoid wrap-around, as in obspy
+        if self.fast_nfft:
+            return scipy.fft.next_fast_len(2 * npts, real=True)
+        return _npts2nfft(npts)
+
+    def spectrum(self, response, npts, delta, output=None):
+        # Deconvolution spectrum of a response for traces of npts samples
+        # (default output: self.output). The Response object is part of the
+        # entry, so its id stays valid as key.
+        output = output or self.output
+        key = (id(response), npts, delta, output)
+        entry = self._spectra.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._spectra.move_to_end(key)
+            return entry[1]
+        self.misses += 1
+        nfft = self.nfft(npts)
+        freq_response, freqs = response.get_evalresp_response(delta, nfft, output=output)
+        if self.water_level is None:
+            freq_response[0] = 0.0
+            freq_response[1:] = 1.0 / freq_response[1:]
+        else:
+            invert_spectrum(freq_response, self.water_level)
+        if self.pre_filt:
+            freq_response *= cosine_sac_taper(freqs, flimit=self.pre_filt)
+        self._spectra[key] = (response, freq_response)
+        if len(self._spectra) > self.maxsize:
+            self._spectra.popitem(last=False)
+        return freq_response
+
+    def _time_taper(self, npts):
+        if npts not in self._tapers:
+            self._tapers[npts] = cosine_taper(npts, self.taper_fraction, sactaper=True, halfcosine=False)
+        return self._tapers[npts]
+
+    def deconvolve(self, traces, outputs=None):
+        # Response-removed data of the traces for one or more outputs (DISP,
+        # VEL, ACC), all from one forward FFT and deconvolution: an output
+        # differs from self.output only by a power of i*omega applied before
+        # its inverse FFT (with exact=True: by its own deconvolution
+        # spectrum). Returns ([(trace, {output: data}), ...],
+        # [(trace, exception), ...]); the traces are not modified.
+        outputs = tuple(outputs or (self.output,))
+        powers = {out: OUTPUTS.index(out) - OUTPUTS.index(self.output) for out in outputs}
+        done, failed, groups = [], [], {}
+        for tr in traces:
+            try:
+                response = tr.stats.response
+                stages = response.response_stages
+                if not stages or isinstance(stages[0], PolynomialResponseStage):
+                    # Polynomial responses are a scaling, left to obspy
+                    if outputs != (self.output,):
+                        raise ValueError(f"Polynomial response of {tr.id} gives {self.output} only")
+                    poly = Trace(tr.data.copy())
+                    poly.stats.response = response
+                    poly.remove_response(output=self.output, pre_filt=self.pre_filt,
+                                         water_level=self.water_level)
+                    done.append((tr, {self.output: poly.data}))
+                    continue
+                if self.exact:
+                    spectrum = {out: self.spectrum(response, tr.stats.npts, tr.stats.delta, out) for out in outputs}
+                else:
+                    spectrum = self.spectrum(response, tr.stats.npts, tr.stats.delta)
+            except Exception as e:
+                failed.append((tr, e))
+                continue
+            groups.setdefault((tr.stats.npts, tr.stats.delta), []).append((tr, spectrum))
+
+        for (npts, delta), group in groups.items():
+            data = np.array([tr.data for tr, _ in group], dtype=np.float64)
+            if self.zero_mean:
+                data -= data.mean(axis=1, keepdims=True)
+            if self.taper:
+                data *= self._time_taper(npts)
+            nfft = self.nfft(npts)
+            spec = scipy.fft.rfft(data, n=nfft, axis=1)
+            if not self.exact:
+                spec *= np.array([s for _, s in group])
+            results = [{} for _ in group]
+            for out, power in powers.items():
+                if self.exact:
+                    out_spec = spec * np.array([s[out] for _, s in group])
+                elif power:
+                    iomega = 2j * np.pi * scipy.fft.rfftfreq(nfft, delta)
+                    if power < 0:
+                        iomega[1:] = 1.0 / iomega[1:]
+                    out_spec = spec * iomega ** abs(power)
+                else:
+                    out_spec = spec.copy()
+                out_spec[:, -1] = np.abs(out_spec[:, -1])
+                for result, row in zip(results, scipy.fft.irfft(out_spec, axis=1)[:, :npts]):
+                    result[out] = row
+            done.extend((tr, result) for (tr, _), result in zip(group, results))
+        return done, failed
+
+    def remove_response(self, traces):
+        # Deconvolve traces in place to self.output; returns
+        # [(trace, exception), ...] for the traces whose response could not be
+        # evaluated (left unchanged)
+        done, failed = self.deconvolve(traces)
+        for tr, result in done:
+            tr.data = result[self.output]
+        return failed
@@ -0,0 +1,343 @@
+###############################################################################
+# Description:
+# Concurrent multi-event waveform download on top of obspy's MassDownloader.
+# Events are downloaded in a thread pool; every provider (KOERI, IRIS, ...)
+# has its own concurrency limit, and a provider request that raises, reports
+# failed downloads or hit a query error is retried with exponential backoff.
+# The mass downloader only logs failed availability and dataselect queries,
+# so each request runs on a session of the provider client that records them
+# (StationXMLClient.session); an event with errors left is journaled failed.
+# Providers are tried in priority order within an event, all writing into the
+# same storage, so data already fetched from an earlier provider is found as
+# existing by the later ones. With a nafz.journal.DownloadJournal, events
+# completed in earlier runs are skipped and every result is journaled.
+# The scheduler is long-lived: each provider's FDSN client is initialised
+# once, and with an availability window the channel-level availability of the
+# domain is fetched once for the whole campaign and answered locally for every
+# event (AvailabilityCachingClient). StationXML files are written to a
+# temporary file and merged into place (StationXMLClient), so events running
+# at the same time can share one file per station (nafz.inventory_store).
+###############################################################################
+import copy
+import logging
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from obspy import read_inventory
+from obspy.clients.fdsn import Client
+from obspy.clients.fdsn.header import FDSNNoDataException
+from obspy.clients.fdsn.mass_downloader import MassDownloader
+from obspy.clients.fdsn.mass_downloader.download_helpers import STATUS
+from tqdm.auto import tqdm
+from nafz.inventory_store import merge_station_file
+
+###############################################################################
+logger = logging.getLogger("nafz.download")
+MASS_DOWNLOADER_LOGGER = logging.getLogger("obspy.clients.fdsn.mass_downloader")
+
+# Result of one event: status is "done" or "failed"
+EventResult = namedtuple("EventResult", ["name", "status", "files", "bytes", "errors", "stations"])
+# Result of one station of one provider: status is "done", "exists" or "failed"
+StationResult = namedtuple("StationResult", ["station", "provider", "status", "files", "bytes"])
+
+# Statuses that make a provider request worth retrying
+FAILED_STATUSES = (STATUS.DOWNLOAD_FAILED, STATUS.DOWNLOAD_PARTIALLY_FAILED)
+
+
+def station_results(provider, helpers, failed_stations=()):
+    # Per-station newly downloaded files / bytes and status of a MassDownloader
+    # result; failed_stations: (network, station) of failed dataselect requests
+    results = []
+    for helper in (helpers or {}).values():
+        for station in helper.stations.values():
+            # Without reliable availability (AvailabilityCachingClient) every
+            # listed channel is requested; one left out of the answer, or
+            # answered with no data (204), had no data in the window. Only
+            # channels of requests that failed count as failed then.
+            no_data = (
+                not helper.is_availability_reliable
+                and (station.network, station.station) not in failed_stations
+            )
+            paths = []
+            if station.stationxml_status == STATUS.DOWNLOADED:
+                paths.append(station.stationxml_filename)
+            interval_statuses = []
+            for channel in station.channels:
+                for interval in channel.intervals:
+                    if no_data and interval.status == STATUS.DOWNLOAD_FAILED:
+                        interval_statuses.append(STATUS.IGNORE)
+                    else:
+                        interval_statuses.append(interval.status)
+                    if interval.status == STATUS.DOWNLOADED:
+                        paths.append(interval.filename)
+            paths = [p for p in paths if isinstance(p, str) and os.path.exists(p)]
+            statuses = [station.stationxml_status] + interval_statuses
+
+            if any(status in FAILED_STATUSES for status in statuses):
+                status = "failed"
+            elif paths:
+                status = "done"
+            elif all(status in (STATUS.EXISTS, STATUS.IGNORE, STATUS.NONE) for status in statuses):
+                status = "exists"
+            else:
+                status = "done"
+            results.append(StationResult(
+                f"{station.network}.{station.station}", provider, status,
+                len(paths), sum(os.path.getsize(p) for p in paths),
+            ))
+    return results
+
+
+class StationXMLClient(Client):
+    # FDSN client that writes StationXML downloads atomically. The mass
+    # downloader writes a station's file in place (get_stations_bulk with
+    # filename=) and parses it afterwards, deleting it if it is not valid XML;
+    # with a file shared by concurrent events another event could read it half
+    # written and delete it, and a download of one event's channels would
+    # drop those of the others. The download goes to a file of its own that
+    # is then merged into the target (nafz.inventory_store.merge_station_file).
+    # The mass downloader logs and swallows query errors (503, timeouts), so
+    # an empty result looks like no data; session() gives a copy for one
+    # request that records them in errors, and the (network, station) of
+    # failed dataselect requests in failed_stations. No data (204) is not an
+    # error.
+    errors = None
+    failed_stations = None
+
+    def session(self):
+        # Shallow copy sharing the services and caches of the client
+        session = copy.copy(self)
+        session.errors = []
+        session.failed_stations = set()
+        return session
+
+    def _record_error(self, service, error):
+        if self.errors is not None and not isinstance(error, FDSNNoDataException):
+            self.errors.append(f"{service}: {type(error).__name__}: {error}".splitlines()[0])
+
+    def get_stations(self, *args, **kwargs):
+        try:
+            return super().get_stations(*args, **kwargs)
+        except Exception as e:
+            self._record_error("availability" if kwargs.get("level") == "channel" else "station", e)
+            raise
+
+    def get_waveforms_bulk(self, bulk, *args, **kwargs):
+        try:
+            return super().get_waveforms_bulk(bulk, *args, **kwargs)
+        except Exception as e:
+            self._record_error("dataselect", e)
+            if self.failed_stations is not None and not isinstance(e, FDSNNoDataException):
+                self.failed_stations.update((line[0], line[1]) for line in bulk)
+            raise
+
+    def get_stations_bulk(self, bulk, *args, filename=None, **kwargs):
+        try:
+            if not isinstance(filename, (str, os.PathLike)):
+                return super().get_stations_bulk(bulk, *args, filename=filename, **kwargs)
+            tmp = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                result = super().get_stations_bulk(bulk, *args, filename=tmp, **kwargs)
+                merge_station_file(filename, read_inventory(tmp))
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            return result
+        except Exception as e:
+            self._record_error("station", e)
+            raise
+
+
+class AvailabilityCachingClient(StationXMLClient):
+    # FDSN client that answers channel-level availability queries (the first
+    # step of every MassDownloader request) from one campaign-wide query per
+    # distinct domain / channel selection. The cached answer does not match
+    # the time series, so matchtimeseries is no longer advertised and the mass
+    # downloader treats availability as unreliable: channels without data in
+    # the window are skipped (station_results), failed requests still fail.
+    # A campaign-wide no data answer (204) is cached, other errors are not.
+    def __init__(self, base_url, starttime, endtime, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.cache_starttime = starttime
+        self.cache_endtime = endtime
+        # Shared with the sessions of the client
+        self._availability_stats = {"queries": 0, "hits": 0}
+        self._availability = {}
+        self._availability_lock = threading.Lock()
+        station_service = dict(self.services.get("station", {}))
+        station_service.pop("matchtimeseries", None)
+        self.services["station"] = station_service
+
+    @property
+    def availability_queries(self):
+        return self._availability_stats["queries"]
+
+    @property
+    def availability_hits(self):
+        return self._availability_stats["hits"]
+
+    def get_stations(self, starttime=None, endtime=None, level=None, **kwargs):
+        if level != "channel" or kwargs.get("filename") is not None:
+            return super().get_stations(starttime=starttime, endtime=endtime, level=level, **kwargs)
+
+        kwargs.pop("matchtimeseries", None)
+        key = tuple(sorted((k, str(v)) for k, v in kwargs.items() if v is not None))
+        with self._availability_lock:
+            if key in self._availability:
+                self._availability_stats["hits"] += 1
+            else:
+                self._availability_stats["queries"] += 1
+                try:
+                    self._availability[key] = super().get_stations(
+                        starttime=self.cache_starttime, endtime=self.cache_endtime,
+                        level="channel", **kwargs
+                    )
+                except FDSNNoDataException as e:
+                    self._availability[key] = e
+            inv = self._availability[key]
+        if isinstance(inv, Exception):
+            raise inv
+        return inv.select(starttime=starttime, endtime=endtime)
+
+
+class DownloadScheduler:
+    def __init__(
+        self,
+        providers=("KOERI", "IRIS"),
+        provider_limits=None,
+        max_workers=8,
+        retries=3,
+        backoff=5.0,
+        threads_per_client=3,
+        journal=None,
+        availability_window=None,
+        client_kwargs=None,
+    ):
+        # provider_limits: {provider: max concurrent requests}, default 2 each
+        self.providers = list(providers)
+        limits = provider_limits or {}
+        self._slots = {p: threading.BoundedSemaphore(limits.get(p, 2)) for p in self.providers}
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.threads_per_client = threads_per_client
+        # nafz.journal.DownloadJournal; events journaled as done are skipped
+        self.journal = journal
+        # (starttime, endtime) of the campaign: cache availability per provider
+        self.availability_window = availability_window
+        # Extra obspy Client arguments, e.g. {"_discover_services": False} for
+        # servers without WADL documents (nafz.fake_fdsn)
+        self.client_kwargs = client_kwargs or {}
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def client(self, provider):
+        # The initialised obspy FDSN client of a provider (one per provider)
+        with self._lock:
+            if provider not in self._clients:
+                if self.availability_window is not None:
+                    client = AvailabilityCachingClient(
+                        provider, *self.availability_window, **self.client_kwargs
+                    )
+                else:
+                    client = StationXMLClient(provider, **self.client_kwargs)
+                self._clients[provider] = client
+            return self._clients[provider]
+
+    def _downloader(self, session):
+        # MassDownloader of one request on a client session
+        with self._lock:
+            # MassDownloader adds a console handler on every configuration
+            configure = not MASS_DOWNLOADER_LOGGER.handlers
+            return MassDownloader(providers=[session], configure_logging=configure)
+
+    def _download_provider(self, provider, domain, restrictions, mseed_storage, stationxml_storage):
+        # Returns (station results, error); error is None on success
+        error, stations = None, []
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                logger.info(f"{provider}: retry {attempt}/{self.retries} in {delay:.1f} s ({error})")
+                time.sleep(delay)
+            session = self.client(provider).session()
+            try:
+                with self._slots[provider]:
+                    helpers = self._downloader(session).download(
+                        domain,
+                        restrictions,
+                        mseed_storage=mseed_storage,
+                        stationxml_storage=stationxml_storage,
+                        threads_per_client=self.threads_per_client,
+                        print_report=False,
+                    )
+            except Exception as e:
+                error = f"{provider}: {type(e).__name__}: {e}"
+                continue
+            # Keep the stations downloaded by earlier attempts in the result
+            done = {s.station: s for s in stations if s.status == "done"}
+            stations = [
+                done.get(s.station, s) if s.status == "exists" else s
+                for s in station_results(provider, helpers, session.failed_stations)
+            ]
+            failed = [s.station for s in stations if s.status == "failed"]
+            if session.errors:
+                # Also without failed stations: a failed availability query
+                # leaves none to fail
+                error = f"{provider}: {len(session.errors)} query error(s), first {session.errors[0]}"
+            elif failed:
+                error = f"{provider}: failed download(s) for {', '.join(failed)}"
+            else:
+                return stations, None
+        return stations, error
+
+    def download_event(self, name, domain, restrictions, mseed_storage, stationxml_storage):
+        stations, errors = [], []
+        for provider in self.providers:
+            provider_stations, error = self._download_provider(
+                provider, domain, restrictions, mseed_storage, stationxml_storage
+            )
+            stations.extend(provider_stations)
+            if error:
+                errors.append(error)
+        return EventResult(
+            name,
+            "failed" if errors else "done",
+            sum(s.files for s in stations),
+            sum(s.bytes for s in stations),
+            errors,
+            stations,
+        )
+
+    def run(self, requests, progress=True):
+        # requests: iterable of (name, domain, restrictions, mseed_storage,
+        # stationxml_storage). Returns the EventResults in completion order.
+        requests = list(requests)
+        if self.journal is not None:
+            completed = self.journal.completed()
+            skipped = sum(request[0] in completed for request in requests)
+            requests = [request for request in requests if request[0] not in completed]
+            if skipped:
+                logger.info(f"Skipping {skipped} event(s) already completed in {self.journal.path}")
+        results = []
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool, tqdm(
+            total=len(requests), desc="Downloading events", unit="event", disable=not progress
+        ) as bar:
+            futures = {pool.submit(self.download_event, *request): request[0] for request in requests}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = EventResult(futures[future], "failed", 0, 0, [f"{type(e).__name__}: {e}"], [])
+                if self.journal is not None:
+                    self.journal.record(result)
+                results.append(result)
+                failed += result.status == "failed"
+                bar.set_postfix(failed=failed, MB=f"{sum(r.bytes for r in results) / 1024 ** 2:.1f}")
+                bar.update()
+                if result.errors:
+                    logger.warning(f"{result.name}: " + "; ".join(result.errors))
+        return results
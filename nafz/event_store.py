@@ -0,0 +1,284 @@
+###############################################################################
+# Description:
+# Per-event waveform container (HDF5) replacing the one-SAC-file-per-trace
+# layout of vel_data/ and friends. One file per event, waveform_h5/<event>.h5:
+#     attrs                event name, origin and hypocenter
+#     /<OUTPUT>/<NET.STA>  data: float32 (channels, npts), gzip + shuffle,
+#                          one chunk per channel; attrs: channels, npts,
+#                          starttime, sampling_rate, SAC headers, file names
+#     /<OUTPUT>/index      one row per station (coordinates, dist, az, ...)
+# OUTPUT is DISP, VEL or ACC. The index answers selections such as the local
+# 2-100 km stations without opening the station groups, the reader returns
+# NumPy views of one read per station, and export_sac writes the legacy SAC
+# files (same names and headers as 2_remove_response.py) for older tools.
+# HDF5 only reuses freed space with persistent free-space tracking (set for
+# new containers), so stations are rewritten in place where their shape is
+# unchanged, and a container whose free space grew past half its data (older
+# files) is repacked into a new file when it is closed.
+#     with EventContainer("waveform_h5/20130919.15.14.h5") as event:
+#         near = event.index("VEL")
+#         waves = event.waveforms("VEL", "KO.ADVT")    # {"BHZ": array, ...}
+#         event.export_sac("VEL", "local_vel_data/20130919.15.14", max_dist=100)
+# Needs h5py (optional: the SAC output of 2_remove_response.py works without).
+###############################################################################
+import json
+import os
+import numpy as np
+from obspy import Stream, Trace, UTCDateTime
+from obspy.core.util import AttribDict
+
+try:
+    import h5py
+except ImportError:  # containers need h5py, SAC files do not
+    h5py = None
+
+###############################################################################
+CONTAINER_VERSION = 1
+# Free space [bytes] a container may keep besides half its data
+REPACK_SLACK = 1 << 20
+# New containers keep track of their free space across sessions and reuse it
+FILE_SPACE = {"fs_strategy": "fsm", "fs_persist": True}
+INDEX_DTYPE = np.dtype([
+    ("station", "S16"),
+    ("channels", "S16"),
+    ("npts", "i8"),
+    ("sampling_rate", "f8"),
+    ("stla", "f8"),
+    ("stlo", "f8"),
+    ("stel", "f8"),
+    ("dist", "f8"),
+    ("az", "f8"),
+    ("baz", "f8"),
+    ("gcarc", "f8"),
+])
+
+
+def _plain(value):
+    # JSON encoder for the numpy scalars of obspy SAC headers
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serialisable")
+
+
+def channel_entry(trace, name=None, data=None):
+    # What a container stores of one trace; small and picklable, so workers
+    # can hand it to the process that writes the container
+    return {
+        "channel": trace.stats.channel,
+        "location": trace.stats.location,
+        "starttime": str(trace.stats.starttime),
+        "sampling_rate": trace.stats.sampling_rate,
+        "sac": dict(trace.stats.get("sac", {})),
+        "name": name,
+        "data": np.asarray(trace.data if data is None else data, dtype=np.float32),
+    }
+
+
+class EventContainer:
+    def __init__(self, path, mode="r"):
+        if h5py is None:
+            raise ImportError("EventContainer needs h5py")
+        self.path = path
+        if mode != "r":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if mode == "a" and not os.path.exists(path):
+            mode = "w-"
+        self._file = h5py.File(path, mode, **(FILE_SPACE if mode in ("w", "w-", "x") else {}))
+        self._dirty = set()
+        self._replaced = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for output in self._dirty:
+            self._write_index(output)
+        self._dirty.clear()
+        if self._replaced and self._unused_bytes() > max(self._data_bytes() // 2, REPACK_SLACK):
+            self._repack()
+        self._file.close()
+
+    def _delete(self, group, name):
+        del group[name]
+        self._replaced = True
+
+    def _data_bytes(self):
+        sizes = []
+        self._file.visititems(
+            lambda name, obj: sizes.append(obj.id.get_storage_size()) if isinstance(obj, h5py.Dataset) else None
+        )
+        return sum(sizes)
+
+    def _unused_bytes(self):
+        self._file.flush()
+        return os.path.getsize(self.path) - self._data_bytes()
+
+    def _repack(self):
+        # Copy everything into a new file that replaces the container
+        tmp = f"{self.path}.{os.getpid()}.repack"
+        with h5py.File(tmp, "w", **FILE_SPACE) as packed:
+            for key, value in self._file.attrs.items():
+                packed.attrs[key] = value
+            for name in self._file:
+                self._file.copy(self._file[name], packed, name=name)
+        self._file.close()
+        os.replace(tmp, self.path)
+        self._file = h5py.File(self.path, "a")
+        self._replaced = False
+
+    @property
+    def event(self):
+        return dict(self._file.attrs)
+
+    def set_event(self, **attrs):
+        self._file.attrs["version"] = CONTAINER_VERSION
+        for key, value in attrs.items():
+            self._file.attrs[key] = value
+
+    def outputs(self):
+        return sorted(self._file.keys())
+
+    def stations(self, output):
+        if output not in self._file:
+            return []
+        return sorted(name for name in self._file[output] if name != "index")
+
+    def has_station(self, output, station):
+        return f"{output}/{station}" in self._file
+
+    def write_station(self, output, station, entries):
+        # entries: channel_entry() of each channel of the station (replaces
+        # what the container held for the station)
+        group = self._file.require_group(output)
+        npts = [len(entry["data"]) for entry in entries]
+        data = np.zeros((len(entries), max(npts)), dtype=np.float32)
+        for row, entry in zip(data, entries):
+            row[:len(entry["data"])] = entry["data"]
+        if station in group and group[station]["data"].shape == data.shape:
+            # Same channels and length (a rerun): rewrite in place
+            g = group[station]
+            g["data"][...] = data
+            # The compressed chunks may not fit where they were
+            self._replaced = True
+        else:
+            if station in group:
+                self._delete(group, station)
+            g = group.create_group(station)
+            g.create_dataset("data", data=data, chunks=(1, data.shape[1]),
+                             compression="gzip", compression_opts=4, shuffle=True)
+        g.attrs["channels"] = json.dumps([entry["channel"] for entry in entries])
+        g.attrs["locations"] = json.dumps([entry["location"] for entry in entries])
+        g.attrs["npts"] = npts
+        g.attrs["starttime"] = json.dumps([entry["starttime"] for entry in entries])
+        g.attrs["sampling_rate"] = [entry["sampling_rate"] for entry in entries]
+        g.attrs["sac"] = json.dumps([entry["sac"] for entry in entries], default=_plain)
+        g.attrs["names"] = json.dumps([entry["name"] for entry in entries])
+        self._dirty.add(output)
+
+    def remove_station(self, output, station):
+        if self.has_station(output, station):
+            self._delete(self._file[output], station)
+            self._dirty.add(output)
+
+    def _write_index(self, output):
+        group = self._file[output]
+        stations = self.stations(output)
+        index = np.zeros(len(stations), dtype=INDEX_DTYPE)
+        for row, station in zip(index, stations):
+            attrs = group[station].attrs
+            sac = json.loads(attrs["sac"])[0]
+            row["station"] = station
+            row["channels"] = ",".join(json.loads(attrs["channels"]))
+            row["npts"] = max(attrs["npts"])
+            row["sampling_rate"] = attrs["sampling_rate"][0]
+            for key in ("stla", "stlo", "stel", "dist", "az", "baz", "gcarc"):
+                row[key] = sac.get(key, np.nan)
+        if "index" in group and group["index"].maxshape == (None,):
+            group["index"].resize(index.shape)
+            group["index"][...] = index
+            return
+        if "index" in group:
+            self._delete(group, "index")
+        group.create_dataset("index", data=index, maxshape=(None,), chunks=(64,))
+
+    def index(self, output, max_dist=None, min_dist=None):
+        # Structured array (INDEX_DTYPE) of the stations of an output
+        if output not in self._file or "index" not in self._file[output]:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        index = self._file[output]["index"][()]
+        keep = np.ones(len(index), dtype=bool)
+        if min_dist is not None:
+            keep &= index["dist"] >= min_dist
+        if max_dist is not None:
+            keep &= index["dist"] <= max_dist
+        return index[keep]
+
+    def waveforms(self, output, station):
+        # {channel: data} as views of one read of the station array
+        g = self._file[output][station]
+        data = g["data"][()]
+        channels = json.loads(g.attrs["channels"])
+        return {cha: data[i, :n] for i, (cha, n) in enumerate(zip(channels, g.attrs["npts"]))}
+
+    def stream(self, output, station):
+        # obspy Stream of a station with its SAC headers in stats.sac
+        g = self._file[output][station]
+        network, sta = station.split(".")
+        waveforms = self.waveforms(output, station)
+        st = Stream()
+        for i, (channel, data) in enumerate(waveforms.items()):
+            tr = Trace(data, header={
+                "network": network,
+                "station": sta,
+                "location": json.loads(g.attrs["locations"])[i],
+                "channel": channel,
+                "starttime": UTCDateTime(json.loads(g.attrs["starttime"])[i]),
+                "sampling_rate": g.attrs["sampling_rate"][i],
+            })
+            tr.stats.sac = AttribDict(json.loads(g.attrs["sac"])[i])
+            st.append(tr)
+        return st
+
+    def export_sac(self, output, directory, stations=None, channels=None, min_dist=None, max_dist=None):
+        # Write the legacy one-file-per-trace SAC layout; returns the paths
+        os.makedirs(directory, exist_ok=True)
+        if stations is None:
+            stations = [s.decode() for s in self.index(output, max_dist, min_dist)["station"]]
+        paths = []
+        for station in stations:
+            names = json.loads(self._file[output][station].attrs["names"])
+            for tr, name in zip(self.stream(output, station), names):
+                if channels is not None and tr.stats.channel not in channels:
+                    continue
+                name = name or f"{tr.id}.SAC"
+                paths.append(os.path.join(directory, name))
+                tr.write(paths[-1], format="SAC")
+        return paths
+
+
+def container_ref(path, output, station):
+    # Output reference of one station in a container, for manifests
+    return f"{path}#{output}/{station}"
+
+
+def ref_exists(ref):
+    path, key = ref.split("#", 1)
+    if h5py is None or not os.path.exists(path):
+        return False
+    with h5py.File(path, "r") as f:
+        return key in f
+
+
+def remove_ref(ref):
+    path, key = ref.split("#", 1)
+    if h5py is None or not os.path.exists(path):
+        return False
+    with EventContainer(path, "a") as event:
+        output, station = key.split("/")
+        if not event.has_station(output, station):
+            return False
+        event.remove_station(output, station)
+    return True
@@ -0,0 +1,203 @@
+###############################################################################
+# Description:
+# Offline FDSN stand-in for developing and benchmarking the downloader. It
+# serves the station (StationXML / text) and dataselect (miniSEED) services
+# of a synthetic network inside the study area, with configurable latency and
+# failure rate, and counts requests and bytes per service.
+#     with FakeFDSNServer(n_stations=20, latency=0.05, failure_rate=0.1) as server:
+#         client = Client(server.url, _discover_services=False)
+###############################################################################
+import io
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+from obspy import Inventory, Stream, Trace, UTCDateTime
+from obspy.core.inventory import Channel, Network, Site, Station
+from obspy.core.inventory.response import Response
+
+###############################################################################
+NETWORK = "XX"
+CHANNELS = (("BHZ", 0.0, -90.0), ("BHN", 0.0, 0.0), ("BHE", 90.0, 0.0))
+EPOCH_START = UTCDateTime(2000, 1, 1)
+
+
+def synthetic_inventory(n_stations, bounds, sampling_rate, seed=0):
+    # n_stations three-component broadband stations, uniform in
+    # bounds = (minlon, minlat, maxlon, maxlat)
+    rng = np.random.default_rng(seed)
+    minlon, minlat, maxlon, maxlat = bounds
+    zeros = [0j, 0j]
+    poles = [-0.037 + 0.037j, -0.037 - 0.037j, -251.3 + 0j]
+    # Normalised (A0) at 1 Hz, so the sensitivity is the stage gain and
+    # evalresp does not warn that they differ on every evaluation
+    s = 2j * np.pi * 1.0
+    normalization = 1.0 / abs(np.prod([s - z for z in zeros]) / np.prod([s - p for p in poles]))
+    response = Response.from_paz(
+        zeros=zeros,
+        poles=poles,
+        stage_gain=1500.0 * 4e5,
+        input_units="M/S",
+        output_units="COUNTS",
+        normalization_factor=normalization,
+    )
+    response.recalculate_overall_sensitivity(1.0)
+    stations = []
+    for i in range(n_stations):
+        lat, lon = rng.uniform(minlat, maxlat), rng.uniform(minlon, maxlon)
+        channels = [
+            Channel(code, "", lat, lon, 100.0, 0.0, azimuth=azimuth, dip=dip,
+                    sample_rate=sampling_rate, start_date=EPOCH_START, response=response)
+            for code, azimuth, dip in CHANNELS
+        ]
+        stations.append(Station(f"S{i:03d}", lat, lon, 100.0, channels=channels,
+                                start_date=EPOCH_START, site=Site(f"Synthetic {i}")))
+    return Inventory(networks=[Network(NETWORK, stations=stations)], source="nafz.fake_fdsn")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeFDSN/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self._dispatch(url.path, params, [])
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        params, lines = {}, []
+        for line in body.splitlines():
+            line = line.strip()
+            if "=" in line:
+                key, value = line.split("=", 1)
+                params[key.strip()] = value.strip()
+            elif line:
+                lines.append(line.split())
+        self._dispatch(urlparse(self.path).path, params, lines)
+
+    def _dispatch(self, path, params, lines):
+        fake = self.server.fake
+        service = path.strip("/").split("/")[1] if path.count("/") >= 2 else path
+        if fake.latency:
+            time.sleep(fake.latency * fake.random.uniform(0.5, 1.5))
+        if path.endswith("/version"):
+            return self._send(200, b"1.1.0", "text/plain", service)
+        if fake.random.random() < fake.failure_rate:
+            fake.count(service, failed=True)
+            return self._send(503, b"Service temporarily unavailable", "text/plain", service)
+        if path.endswith("/station/1/query"):
+            body, content_type = fake.station_query(params, lines)
+        elif path.endswith("/dataselect/1/query"):
+            body, content_type = fake.dataselect_query(params, lines)
+        else:
+            return self._send(404, b"Not found", "text/plain", service)
+        if body is None:
+            return self._send(204, b"", "text/plain", service)
+        self._send(200, body, content_type, service)
+
+    def _send(self, code, body, content_type, service):
+        self.server.fake.count(service, nbytes=len(body))
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeFDSNServer:
+    def __init__(self, n_stations=10, latency=0.0, failure_rate=0.0, sampling_rate=40.0,
+                 bounds=(29.6, 40.0, 31.0, 41.2), seed=0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sampling_rate = sampling_rate
+        self.random = random.Random(seed)
+        self.inventory = synthetic_inventory(n_stations, bounds, sampling_rate, seed)
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def count(self, service, nbytes=0, failed=False):
+        with self._lock:
+            stats = self.stats.setdefault(service, {"requests": 0, "failures": 0, "bytes": 0})
+            if failed:
+                stats["failures"] += 1
+            else:
+                stats["requests"] += 1
+                stats["bytes"] += nbytes
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {}
+
+    def _select(self, lines):
+        # Sub-inventory matching the (network station location channel ...)
+        # lines of a bulk request, or everything for a plain query
+        if not lines:
+            return self.inventory
+        inv = Inventory(networks=[], source=self.inventory.source)
+        for net, sta, loc, cha, *_ in lines:
+            loc = "" if loc == "--" else loc
+            inv += self.inventory.select(network=net, station=sta, location=loc, channel=cha)
+        return inv
+
+    def station_query(self, params, lines):
+        inv = self._select(lines)
+        if not inv.get_contents()["channels"]:
+            return None, None
+        level = params.get("level", "station")
+        if params.get("format") == "text":
+            buf = io.StringIO()
+            inv.write(buf, format="STATIONTXT", level=level if level != "response" else "channel")
+            return buf.getvalue().encode(), "text/plain"
+        buf = io.BytesIO()
+        inv.write(buf, format="STATIONXML")
+        return buf.getvalue(), "application/xml"
+
+    def dataselect_query(self, params, lines):
+        if not lines and "network" in params:
+            lines = [[params.get(k, "*") for k in ("network", "station", "location", "channel")]
+                     + [params["starttime"], params["endtime"]]]
+        st = Stream()
+        rng = np.random.default_rng(self.random.getrandbits(32))
+        for net, sta, loc, cha, start, end in lines:
+            loc = "" if loc == "--" else loc
+            start, end = UTCDateTime(start), UTCDateTime(end)
+            for channel in self.inventory.select(network=net, station=sta, location=loc, channel=cha).get_contents()["channels"]:
+                n, s, l, c = channel.split(".")
+                npts = int(round((end - start) * self.sampling_rate)) + 1
+                data = rng.normal(0.0, 1000.0, npts).astype(np.int32)
+                st += Trace(data, header={"network": n, "station": s, "location": l, "channel": c,
+                                          "starttime": start, "sampling_rate": self.sampling_rate})
+        if not len(st):
+            return None, None
+        buf = io.BytesIO()
+        st.write(buf, format="MSEED", encoding="STEIM2")
+        return buf.getvalue(), "application/vnd.fdsn.mseed"
@@ -0,0 +1,111 @@
+###############################################################################
+# Description:
+# Campaign-wide StationXML store: one file per station, response/stations/
+# NET.STA.xml, holding every channel epoch of that station over the whole
+# campaign. The mass downloader is pointed at it (stationxml_storage) and asked
+# for the campaign time range (Restrictions station_starttime/endtime), so a
+# station's response is downloaded once and then found as existing by every
+# later event. Event directories written by older runs (response/<event>/)
+# are still used as a fallback. Concurrent events share the station files, so
+# they are only ever replaced whole (nafz.download.StationXMLClient, prefetch),
+# and a download is merged into the file: a later event that needs channels
+# the file lacks adds their epochs and keeps those of earlier events. The file
+# is left untouched (same fingerprint for 2_remove_response.py) when nothing
+# is new.
+###############################################################################
+import copy
+import os
+import threading
+from obspy import Inventory, read_inventory
+
+###############################################################################
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+
+
+def _file_lock(path):
+    # One writer per station file among the download threads
+    with _file_locks_lock:
+        return _file_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def merge_inventory(inv, other):
+    # inv with the channel epochs of other that it lacks, one network per code
+    # and one station per code and start date (servers may repeat them per
+    # requested channel); returns (merged inventory, number of epochs added)
+    added = 0
+    for net in other:
+        target = next((n for n in inv if n.code == net.code), None)
+        if target is None:
+            target = copy.copy(net)
+            target.stations = []
+            inv.networks.append(target)
+        for sta in net:
+            target_sta = next((s for s in target if s.code == sta.code and s.start_date == sta.start_date), None)
+            if target_sta is None:
+                target_sta = copy.copy(sta)
+                target_sta.channels = []
+                target.stations.append(target_sta)
+            # UTCDateTime is not hashable
+            known = {(cha.location_code, cha.code, str(cha.start_date)) for cha in target_sta}
+            new = [cha for cha in sta if (cha.location_code, cha.code, str(cha.start_date)) not in known]
+            target_sta.channels.extend(new)
+            added += len(new)
+    return inv, added
+
+
+def merge_station_file(path, inv):
+    # Add the channel epochs of inv to the StationXML file at path (created
+    # if missing or unreadable); returns the number of epochs added
+    with _file_lock(path):
+        try:
+            existing = read_inventory(path)
+        except Exception:
+            existing = Inventory(networks=[], source=inv.source, sender=inv.sender)
+        merged, added = merge_inventory(existing, inv)
+        if added:
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.merge"
+            merged.write(tmp, format="STATIONXML")
+            os.replace(tmp, path)
+    return added
+
+
+class InventoryStore:
+    def __init__(self, root="response/stations", legacy_root="response"):
+        self.root = root
+        self.legacy_root = legacy_root
+
+    @property
+    def storage(self):
+        # stationxml_storage template for MassDownloader.download
+        return os.path.join(self.root, "{network}.{station}.xml")
+
+    def path(self, network, station):
+        return os.path.join(self.root, f"{network}.{station}.xml")
+
+    def resolve(self, event_dir, network, station):
+        # Campaign file if present, else the per-event copy of older runs
+        path = self.path(network, station)
+        if os.path.exists(path):
+            return path
+        return os.path.join(self.legacy_root, event_dir, f"{network}.{station}.xml")
+
+    def prefetch(self, client, starttime, endtime, minlatitude, maxlatitude,
+                 minlongitude, maxlongitude, channel="BH?"):
+        # Fetch the responses of all stations in the domain in one request and
+        # merge them into the per-station files. Epochs already in the store
+        # are kept, so providers should be prefetched in priority order.
+        inv = client.get_stations(
+            starttime=starttime, endtime=endtime,
+            minlatitude=minlatitude, maxlatitude=maxlatitude,
+            minlongitude=minlongitude, maxlongitude=maxlongitude,
+            channel=channel, level="response",
+        )
+        os.makedirs(self.root, exist_ok=True)
+        written = []
+        for net in inv:
+            for sta_code in sorted({sta.code for sta in net}):
+                if merge_station_file(self.path(net.code, sta_code), inv.select(network=net.code, station=sta_code)):
+                    written.append(f"{net.code}.{sta_code}")
+        return written
+
@@ -0,0 +1,104 @@
+###############################################################################
+# Description:
+# Persistent SQLite journal of a download campaign. It records the status,
+# file and byte counts and errors per event and per station, so that a rerun
+# of 1_mass_download.py skips completed events and only retries failed ones.
+###############################################################################
+import sqlite3
+import threading
+import time
+
+###############################################################################
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    name     TEXT PRIMARY KEY,
+    status   TEXT NOT NULL,
+    files    INTEGER NOT NULL DEFAULT 0,
+    bytes    INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error    TEXT,
+    updated  REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stations (
+    event    TEXT NOT NULL,
+    station  TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    status   TEXT NOT NULL,
+    files    INTEGER NOT NULL DEFAULT 0,
+    bytes    INTEGER NOT NULL DEFAULT 0,
+    updated  REAL NOT NULL,
+    PRIMARY KEY (event, station, provider)
+);
+CREATE INDEX IF NOT EXISTS events_status ON events (status);
+"""
+
+
+class DownloadJournal:
+    # Safe to share between the download threads
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def status(self, name):
+        with self._lock:
+            row = self._db.execute("SELECT status FROM events WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def completed(self):
+        with self._lock:
+            rows = self._db.execute("SELECT name FROM events WHERE status = 'done'").fetchall()
+        return {name for name, in rows}
+
+    def failed(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT name, error FROM events WHERE status = 'failed' ORDER BY name"
+            ).fetchall()
+        return rows
+
+    def record(self, result):
+        # result: nafz.download.EventResult
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                """
+                INSERT INTO events (name, status, files, bytes, attempts, error, updated)
+                VALUES (?, ?, ?, ?, 1, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    status = excluded.status,
+                    files = events.files + excluded.files,
+                    bytes = events.bytes + excluded.bytes,
+                    attempts = events.attempts + 1,
+                    error = excluded.error,
+                    updated = excluded.updated
+                """,
+                (result.name, result.status, result.files, result.bytes,
+                 "; ".join(result.errors) or None, now),
+            )
+            self._db.executemany(
+                """
+                INSERT INTO stations (event, station, provider, status, files, bytes, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (event, station, provider) DO UPDATE SET
+                    status = excluded.status,
+                    files = stations.files + excluded.files,
+                    bytes = stations.bytes + excluded.bytes,
+                    updated = excluded.updated
+                """,
+                [(result.name, s.station, s.provider, s.status, s.files, s.bytes, now)
+                 for s in result.stations],
+            )
+
+    def summary(self):
+        # {status: (events, files, bytes)}
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, COUNT(*), SUM(files), SUM(bytes) FROM events GROUP BY status"
+            ).fetchall()
+        return {status: (n, files or 0, size or 0) for status, n, files, size in rows}
@@ -0,0 +1,183 @@
+###############################################################################
+# Description:
+# Persistent SQLite manifest of a processing run (2_remove_response.py). For
+# every task (one station of one event) it records a fingerprint of the
+# inputs (SHA-256 of the miniSEED and StationXML files) and of the processing
+# parameters, the outputs written and the log entries of the task. A rerun
+# only processes tasks whose fingerprint changed and removes the outputs of
+# tasks that changed or disappeared (files, or stations of nafz.event_store
+# containers). File hashes are cached by size and mtime, so unchanged inputs
+# are not read again; hash_files hashes the new and changed ones of a run in
+# a process pool up front.
+###############################################################################
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from nafz.catalog_io import file_sha256
+from nafz.event_store import ref_exists, remove_ref
+
+###############################################################################
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    key         TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    params      TEXT NOT NULL,
+    outputs     TEXT NOT NULL,
+    result      TEXT NOT NULL,
+    updated     REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path     TEXT PRIMARY KEY,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256   TEXT NOT NULL
+);
+"""
+
+
+def params_fingerprint(params):
+    # Stable hash of the processing parameters (JSON-serialisable)
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+class ProcessingManifest:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def file_hash(self, path):
+        # SHA-256 of a file, "missing" if it does not exist
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return "missing"
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime_ns, sha256 FROM files WHERE path = ?", (path,)
+            ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+        sha256 = file_sha256(path)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, sha256),
+            )
+        return sha256
+
+    def hash_files(self, paths, processes=None):
+        # Hash the files whose size or mtime changed since they were last
+        # hashed (missing ones are skipped) in a process pool, so file_hash
+        # finds them cached; returns the number of files hashed
+        with self._lock:
+            cached = {
+                path: (size, mtime_ns)
+                for path, size, mtime_ns in self._db.execute("SELECT path, size, mtime_ns FROM files")
+            }
+        stale = []
+        for path in sorted(set(paths)):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if cached.get(path) != (stat.st_size, stat.st_mtime_ns):
+                stale.append((path, stat))
+        if not stale:
+            return 0
+        processes = processes or os.cpu_count()
+        if processes == 1 or len(stale) < 2:
+            hashes = [file_sha256(path) for path, _ in stale]
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                hashes = list(pool.map(file_sha256, [path for path, _ in stale],
+                                       chunksize=max(1, len(stale) // (processes * 4))))
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                [(path, stat.st_size, stat.st_mtime_ns, sha256) for (path, stat), sha256 in zip(stale, hashes)],
+            )
+        return len(stale)
+
+    def fingerprint(self, inputs, params):
+        # Fingerprint of a task from its input files and parameters
+        sha = hashlib.sha256(params_fingerprint(params).encode())
+        for path in sorted(inputs):
+            sha.update(f"{path}\0{self.file_hash(path)}\0".encode())
+        return sha.hexdigest()
+
+    def current(self, key, fingerprint):
+        # Stored result of a task if it is up to date and its outputs exist
+        with self._lock:
+            row = self._db.execute(
+                "SELECT fingerprint, outputs, result FROM tasks WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[0] != fingerprint:
+            return None
+        if not all(output_exists(path) for path in json.loads(row[1])):
+            return None
+        return json.loads(row[2])
+
+    def outputs(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT outputs FROM tasks WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def record(self, key, fingerprint, params, outputs, result):
+        # Outputs of the previous run of the task that were not written again
+        # are removed
+        stale = set(self.outputs(key)) - set(outputs)
+        remove_files(stale)
+        with self._lock, self._db:
+            self._db.execute(
+                """
+                INSERT OR REPLACE INTO tasks (key, fingerprint, params, outputs, result, updated)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (key, fingerprint, json.dumps(params, sort_keys=True), json.dumps(sorted(outputs)),
+                 json.dumps(result), time.time()),
+            )
+        return len(stale)
+
+    def prune(self, keys):
+        # Remove the tasks (and their outputs) that are not in keys any more
+        keys = set(keys)
+        with self._lock:
+            rows = self._db.execute("SELECT key, outputs FROM tasks").fetchall()
+        gone = [(key, json.loads(outputs)) for key, outputs in rows if key not in keys]
+        removed = 0
+        for key, outputs in gone:
+            removed += remove_files(outputs)
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM tasks WHERE key = ?", [(key,) for key, _ in gone])
+        return len(gone), removed
+
+
+def output_exists(path):
+    # Outputs are files or stations of an event container (file.h5#VEL/NET.STA)
+    if "#" in path:
+        return ref_exists(path)
+    return os.path.exists(path)
+
+
+def remove_files(paths):
+    removed = 0
+    for path in paths:
+        if "#" in path:
+            removed += remove_ref(path)
+            continue
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
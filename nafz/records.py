@@ -0,0 +1,120 @@
+###############################################################################
+# Description:
+# Compact, array-backed event and station records. Catalogs and station lists
+# are NumPy structured arrays with typed float and datetime64 fields; the
+# EventRecord / StationRecord classes are __slots__ views of one row, so no
+# per-row Python objects or strings are kept around, and sorting or filtering
+# is done on the arrays directly.
+###############################################################################
+import numpy as np
+import pandas as pd
+
+###############################################################################
+EVENT_DTYPE = np.dtype([
+    ("name", "S14"),  # event directory name, YYYYMMDD.HH.MM
+    ("time", "datetime64[ms]"),
+    ("latitude", "f8"),
+    ("longitude", "f8"),
+    ("depth", "f8"),
+    ("magnitude", "f8"),
+])
+
+STATION_DTYPE = np.dtype([
+    ("name", "S16"),  # NET.STA
+    ("latitude", "f8"),
+    ("longitude", "f8"),
+    ("elevation", "f8"),
+])
+
+
+def event_table(names, times, latitude, longitude, depth, magnitude):
+    table = np.empty(len(names), dtype=EVENT_DTYPE)
+    table["name"] = np.char.encode(np.asarray(names, dtype=str), "ascii")
+    table["time"] = np.asarray(times, dtype="datetime64[ms]")
+    table["latitude"] = latitude
+    table["longitude"] = longitude
+    table["depth"] = depth
+    table["magnitude"] = magnitude
+    return table
+
+
+def station_table(rows):
+    # rows of (name, latitude, longitude, elevation)
+    rows = [(name.encode("ascii"), lat, lon, elev) for name, lat, lon, elev in rows]
+    return np.array(rows, dtype=STATION_DTYPE)
+
+
+class _RowView:
+    # View of row i of a structured array; pickles as a one-row copy so that
+    # sending a record to a worker process does not send the whole table
+    __slots__ = ("_table", "_i")
+
+    def __init__(self, table, i):
+        self._table = table
+        self._i = i
+
+    def __reduce__(self):
+        return (type(self), (self._table[self._i:self._i + 1].copy(), 0))
+
+    def __repr__(self):
+        return repr(self._table[self._i].tolist())
+
+    @property
+    def name(self):
+        return self._table["name"][self._i].decode("ascii")
+
+    @property
+    def latitude(self):
+        return float(self._table["latitude"][self._i])
+
+    @property
+    def longitude(self):
+        return float(self._table["longitude"][self._i])
+
+
+class EventRecord(_RowView):
+    # One catalog event; date and time fields are formatted as in the .par file
+    __slots__ = ()
+
+    @property
+    def time(self):
+        return self._table["time"][self._i]
+
+    @property
+    def depth(self):
+        return float(self._table["depth"][self._i])
+
+    @property
+    def magnitude(self):
+        return float(self._table["magnitude"][self._i])
+
+    @property
+    def ymd(self):
+        return pd.Timestamp(self.time).strftime("%Y%m%d")
+
+    @property
+    def hour(self):
+        return f"{pd.Timestamp(self.time).hour:02d}"
+
+    @property
+    def minute(self):
+        return f"{pd.Timestamp(self.time).minute:02d}"
+
+    @property
+    def second(self):
+        t = pd.Timestamp(self.time)
+        return f"{t.second + t.microsecond / 1e6:06.3f}"
+
+
+class StationRecord(_RowView):
+    __slots__ = ()
+
+    @property
+    def elevation(self):
+        return float(self._table["elevation"][self._i])
+
+
+def records(table, cls):
+    # Iterate over row views of a structured array
+    for i in range(table.size):
+        yield cls(table, i)
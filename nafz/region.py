@@ -0,0 +1,59 @@
+###############################################################################
+# Description:
+# Vectorized geographical filtering of seismic event catalogs.
+# A region can be a shapely Polygon or MultiPolygon, a list of them, or a
+# dict / list of (name, geometry) pairs for several named regions at once.
+###############################################################################
+import numpy as np
+
+try:
+    from shapely import contains_xy, prepare
+except ImportError:  # shapely < 2.0
+    from shapely.vectorized import contains as contains_xy
+
+    def prepare(geometry):
+        pass
+
+###############################################################################
+def named_regions(regions):
+    # Normalise the accepted region specifications to a list of (name, geometry)
+    if hasattr(regions, "geom_type"):
+        return [(regions.geom_type, regions)]
+    if isinstance(regions, dict):
+        return list(regions.items())
+
+    named = []
+    for i, region in enumerate(regions):
+        if hasattr(region, "geom_type"):
+            named.append((f"region_{i}", region))
+        else:
+            name, geometry = region
+            named.append((name, geometry))
+    return named
+
+
+def _contains(geometry, lon, lat):
+    # Point-in-polygon test for all events, restricted to the geometry bounds
+    minx, miny, maxx, maxy = geometry.bounds
+    inside = (lon >= minx) & (lon <= maxx) & (lat >= miny) & (lat <= maxy)
+    idx = np.flatnonzero(inside)
+    if idx.size:
+        prepare(geometry)
+        inside[idx] = contains_xy(geometry, lon[idx], lat[idx])
+    return inside
+
+
+def region_masks(lat, lon, regions):
+    # Return {name: boolean mask} with one mask per named region
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    return {name: _contains(geometry, lon, lat) for name, geometry in named_regions(regions)}
+
+
+def region_mask(lat, lon, regions):
+    # Return a boolean mask of the events inside any of the regions
+    lat = np.asarray(lat, dtype=np.float64)
+    mask = np.zeros(lat.shape, dtype=bool)
+    for inside in region_masks(lat, lon, regions).values():
+        mask |= inside
+    return mask
@@ -0,0 +1,96 @@
+###############################################################################
+# Description:
+# Persistent instrument-response cache. Each StationXML file is parsed once per
+# campaign into a table of channel epochs (seed id, start, end, Response,
+# coordinates) that is pickled next to it (.cache/NET.STA.xml.responses.pkl)
+# and revalidated like the catalog caches (size, mtime, SHA-256). Every
+# process keeps the tables it has loaded in an LRU, so the channels of an
+# event and later events of the same station cost a dict lookup.
+#     response, coords = channel_response(path, trace.id, trace.stats.starttime)
+###############################################################################
+import os
+import pickle
+from functools import lru_cache
+from obspy import read_inventory
+from nafz.catalog_io import cache_is_valid, cache_paths, write_cache_key
+
+###############################################################################
+RESPONSE_CACHE_VERSION = 1
+
+
+class ResponseNotFound(LookupError):
+    pass
+
+
+def build_response_table(inv):
+    # {seed id: [(start, end, Response, (lat, lon, elevation)), ...]} with
+    # timestamps as floats (end None -> open epoch), plus the first station's
+    # coordinates for channels without their own
+    channels = {}
+    station = None
+    for net in inv:
+        for sta in net:
+            if station is None:
+                station = (sta.latitude, sta.longitude, sta.elevation)
+            for cha in sta:
+                seed_id = f"{net.code}.{sta.code}.{cha.location_code}.{cha.code}"
+                channels.setdefault(seed_id, []).append((
+                    cha.start_date.timestamp if cha.start_date is not None else float("-inf"),
+                    cha.end_date.timestamp if cha.end_date is not None else float("inf"),
+                    cha.response,
+                    (cha.latitude, cha.longitude, cha.elevation),
+                ))
+    return {"version": RESPONSE_CACHE_VERSION, "channels": channels, "station": station}
+
+
+def _load_pickled(table_path):
+    try:
+        with open(table_path, "rb") as f:
+            table = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    if table.get("version") != RESPONSE_CACHE_VERSION:
+        return None
+    return table
+
+
+@lru_cache(maxsize=512)
+def _response_table(path, mtime_ns, cache_dir):
+    table_path, key_path = cache_paths(path, cache_dir, suffix=".responses.pkl")
+    try:
+        valid = cache_is_valid(path, table_path, key_path)
+    except ValueError:
+        # Key file being written by another worker
+        valid = False
+    if valid:
+        table = _load_pickled(table_path)
+        if table is not None:
+            return table
+
+    table = build_response_table(read_inventory(path))
+    os.makedirs(os.path.dirname(table_path), exist_ok=True)
+    tmp = f"{table_path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(table, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, table_path)
+    write_cache_key(path, key_path)
+    return table
+
+
+def response_table(path, cache_dir=None):
+    # Raises FileNotFoundError like read_inventory when there is no file
+    return _response_table(path, os.stat(path).st_mtime_ns, cache_dir)
+
+
+def channel_response(path, seed_id, time, cache_dir=None):
+    # (Response, (lat, lon, elevation)) of the channel epoch valid at time
+    table = response_table(path, cache_dir)
+    t = time.timestamp
+    for start, end, response, coords in table["channels"].get(seed_id, ()):
+        if start <= t <= end:
+            return response, coords
+    raise ResponseNotFound(f"No response for {seed_id} at {time} in {path}")
+
+
+def station_coordinates(path, cache_dir=None):
+    return response_table(path, cache_dir)["station"]
@@ -0,0 +1,36 @@
+###############################################################################
+# Description:
+# In-process SAC header writing. Sets the event and station headers that the
+# pre-processing used to set by running the sac binary on every output file
+# (ch evla/evlo/evdp, stla/stlo/stel, t1-t4, o gmt, LCALDA True), including
+# the distance, azimuth, back-azimuth and great-circle arc that SAC computes
+# with LCALDA. The headers go into trace.stats.sac and are written by
+# obspy's SAC writer, so the sac binary is no longer needed.
+###############################################################################
+from obspy.geodetics import gps2dist_azimuth, locations2degrees
+from obspy.io.sac.util import get_sac_reftime, obspy_to_sac_header
+
+###############################################################################
+def event_station_geometry(evla, evlo, stla, stlo):
+    # (dist [km], az, baz [deg], gcarc [deg]) as SAC computes with LCALDA
+    dist_m, az, baz = gps2dist_azimuth(evla, evlo, stla, stlo)
+    return dist_m / 1000.0, az, baz, locations2degrees(evla, evlo, stla, stlo)
+
+
+def set_sac_headers(trace, evla, evlo, evdp, stla, stlo, stel, origin_time, picks=(0.0, 0.0, 0.0, 0.0)):
+    # Reference time and b/e as obspy writes them for a trace without a SAC
+    # header; o and t1-t4 are relative to it
+    header = obspy_to_sac_header(trace.stats, keep_sac_header=False)
+    reftime = get_sac_reftime(header)
+    dist, az, baz, gcarc = event_station_geometry(evla, evlo, stla, stlo)
+    header.update(
+        evla=evla, evlo=evlo, evdp=evdp,
+        stla=stla, stlo=stlo, stel=stel,
+        o=origin_time - reftime,
+        lcalda=True,
+        dist=dist, az=az, baz=baz, gcarc=gcarc,
+    )
+    for i, pick in enumerate(picks, start=1):
+        header[f"t{i}"] = pick
+    trace.stats.sac = header
+    return header
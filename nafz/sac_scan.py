@@ -0,0 +1,111 @@
+###############################################################################
+# Description:
+# Header-only SAC scanner. read_sac_header parses the 632-byte binary header
+# (70 floats, 40 ints, 24 8-character strings) without touching the samples,
+# detecting the byte order from nvhdr. scan_directory lists the SAC files of
+# one event directory with os.scandir and reads their headers, skipping files
+# whose size and mtime are already known (nafz.trace_index fans it out over
+# the event directories):
+#     scan_directory("local_vel_data/20130919.15.14")
+#     # [(file name, os.stat_result, {"kstnm": ..., "stla": ...}), ...]
+# Undefined header values (SAC -12345 / "-12345") are left out of the dicts,
+# as obspy does for stats.sac. write_sac_header patches header fields in
+# place (e.g. picks) without reading or rewriting the samples.
+###############################################################################
+import os
+import numpy as np
+from obspy.io.sac.header import FLOATHDRS, FNULL, INTHDRS, INULL, STRHDRS
+
+###############################################################################
+HEADER_SIZE = 632
+FLOAT_BYTES = 4 * len(FLOATHDRS)
+INT_BYTES = 4 * len(INTHDRS)
+NVHDR = INTHDRS.index("nvhdr")
+# Byte offsets of the string headers (kevnm spans two 8-character slots)
+STR_OFFSETS = {}
+_offset = FLOAT_BYTES + INT_BYTES
+for _name in STRHDRS:
+    if _name == "kevnm2":
+        continue
+    STR_OFFSETS[_name] = (_offset, 16 if _name == "kevnm" else 8)
+    _offset += STR_OFFSETS[_name][1]
+
+
+def parse_sac_header(buf, fields=None):
+    # {field: value} of a 632-byte SAC header, undefined values omitted
+    if len(buf) < HEADER_SIZE:
+        raise ValueError(f"SAC header needs {HEADER_SIZE} bytes, got {len(buf)}")
+    byteorder = "<"
+    if np.frombuffer(buf, "<i4", 1, FLOAT_BYTES + 4 * NVHDR)[0] not in (6, 7):
+        byteorder = ">"
+    floats = np.frombuffer(buf, f"{byteorder}f4", len(FLOATHDRS), 0)
+    ints = np.frombuffer(buf, f"{byteorder}i4", len(INTHDRS), FLOAT_BYTES)
+    wanted = set(fields) if fields is not None else None
+    header = {}
+    for name, value in zip(FLOATHDRS, floats):
+        if (wanted is None or name in wanted) and value != FNULL:
+            header[name] = float(value)
+    for name, value in zip(INTHDRS, ints):
+        if (wanted is None or name in wanted) and value != INULL:
+            header[name] = int(value)
+    for name, (offset, size) in STR_OFFSETS.items():
+        if wanted is None or name in wanted:
+            value = buf[offset:offset + size].decode("ascii", "replace").strip()
+            if value.replace("-12345", "").strip():
+                header[name] = value
+    return header
+
+
+def read_sac_header(path, fields=None):
+    with open(path, "rb") as f:
+        return parse_sac_header(f.read(HEADER_SIZE), fields)
+
+
+def write_sac_header(path, values):
+    # Set header fields of a SAC file in place, in the byte order of the
+    # file; None writes the undefined value
+    with open(path, "r+b") as f:
+        buf = f.read(HEADER_SIZE)
+        if len(buf) < HEADER_SIZE:
+            raise ValueError(f"SAC header needs {HEADER_SIZE} bytes, got {len(buf)}")
+        byteorder = "<"
+        if np.frombuffer(buf, "<i4", 1, FLOAT_BYTES + 4 * NVHDR)[0] not in (6, 7):
+            byteorder = ">"
+        for name, value in values.items():
+            if name in FLOATHDRS:
+                offset = 4 * FLOATHDRS.index(name)
+                data = np.array(FNULL if value is None else value, f"{byteorder}f4").tobytes()
+            elif name in INTHDRS:
+                offset = FLOAT_BYTES + 4 * INTHDRS.index(name)
+                data = np.array(INULL if value is None else value, f"{byteorder}i4").tobytes()
+            elif name in STR_OFFSETS:
+                offset, size = STR_OFFSETS[name]
+                value = "-12345" if value is None else value
+                data = value.encode("ascii", "replace")[:size].ljust(size)
+            else:
+                raise KeyError(f"Unknown SAC header: {name}")
+            f.seek(offset)
+            f.write(data)
+
+
+def scan_directory(directory, suffix=".SAC", fields=None, known=None):
+    # [(file name, stat, header)] of the SAC files of one directory, sorted
+    # by name; None if the directory does not exist. Unreadable files get
+    # header {}; files whose (size, mtime_ns) equals known[file name] are not
+    # read and get header None.
+    try:
+        entries = [e for e in os.scandir(directory) if e.name.endswith(suffix) and e.is_file()]
+    except FileNotFoundError:
+        return None
+    known = known or {}
+    result = []
+    for entry in sorted(entries, key=lambda e: e.name):
+        stat = entry.stat()
+        header = None
+        if known.get(entry.name) != (stat.st_size, stat.st_mtime_ns):
+            try:
+                header = read_sac_header(entry.path, fields)
+            except (OSError, ValueError):
+                header = {}
+        result.append((entry.name, stat, header))
+    return result
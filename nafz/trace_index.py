@@ -0,0 +1,221 @@
+###############################################################################
+# Description:
+# SQLite index of the processed SAC traces shared by the pipeline stages. One
+# row per file with its dataset (top directory: vel_data, local_vel_data,
+# ...), event, network/station/location/channel, sampling rate, npts,
+# station coordinates, distance/azimuth and pick headers (t1-t4), read from
+# the SAC header only (nafz.sac_scan). 2_remove_response.py adds the files it
+# writes; sync() brings a dataset up to date, re-reading only files whose
+# size or mtime changed. Paths are stored relative to the root of the index,
+# by default the directory holding log/ (the project directory), so the
+# database answers the same from any working directory; full_path() gives
+# the path to open. Stages query it instead of globbing:
+#     index = TraceIndex("log/trace_index.sqlite")
+#     index.traces("local_vel_data", event="20130919.15.14", exclude_networks=("KO",))
+#     index.complete_stations("local_vel_data", event="20130919.15.14")
+###############################################################################
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from nafz.sac_scan import read_sac_header, scan_directory
+
+###############################################################################
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS traces (
+    path          TEXT PRIMARY KEY,
+    dataset       TEXT NOT NULL,
+    event         TEXT NOT NULL,
+    network       TEXT,
+    station       TEXT,
+    location      TEXT,
+    channel       TEXT,
+    sampling_rate REAL,
+    npts          INTEGER,
+    stla          REAL,
+    stlo          REAL,
+    stel          REAL,
+    dist          REAL,
+    az            REAL,
+    baz           REAL,
+    gcarc         REAL,
+    t1            REAL,
+    t2            REAL,
+    t3            REAL,
+    t4            REAL,
+    size          INTEGER NOT NULL,
+    mtime_ns      INTEGER NOT NULL,
+    updated       REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS traces_event ON traces (dataset, event);
+CREATE INDEX IF NOT EXISTS traces_station ON traces (dataset, network, station, channel);
+"""
+COLUMNS = (
+    "path", "dataset", "event", "network", "station", "location", "channel",
+    "sampling_rate", "npts", "stla", "stlo", "stel", "dist", "az", "baz", "gcarc",
+    "t1", "t2", "t3", "t4", "size", "mtime_ns", "updated",
+)
+HEADER_FIELDS = (
+    "knetwk", "kstnm", "khole", "kcmpnm", "delta", "npts", "stla", "stlo", "stel",
+    "dist", "az", "baz", "gcarc", "t1", "t2", "t3", "t4",
+)
+TRIPLET = ("BHZ", "BHN", "BHE")
+
+
+def trace_row(path, dataset, event, header, stat):
+    # Row of the traces table from a scanned SAC header
+    delta = header.get("delta")
+    return (
+        path, dataset, event,
+        header.get("knetwk"), header.get("kstnm"), header.get("khole", ""), header.get("kcmpnm"),
+        1.0 / delta if delta else None, header.get("npts"),
+        header.get("stla"), header.get("stlo"), header.get("stel"),
+        header.get("dist"), header.get("az"), header.get("baz"), header.get("gcarc"),
+        header.get("t1"), header.get("t2"), header.get("t3"), header.get("t4"),
+        stat.st_size, stat.st_mtime_ns, time.time(),
+    )
+
+
+def _scan_event(args):
+    # Rows of the new or changed SAC files of one event directory, and the
+    # paths of all of them (relative to the index root)
+    root, dataset, event, known, suffix = args
+    prefix = os.path.join(dataset, event)
+    known = {os.path.basename(path): stat for path, stat in known.items()}
+    rows, paths = [], []
+    for name, stat, header in scan_directory(os.path.join(root, prefix), suffix, HEADER_FIELDS, known) or []:
+        path = os.path.join(prefix, name)
+        paths.append(path)
+        if header is not None:
+            rows.append(trace_row(path, dataset, event, header, stat))
+    return rows, paths
+
+
+class TraceIndex:
+    def __init__(self, path, root=None):
+        self.path = path
+        # Directory the stored paths are relative to (datasets below it)
+        if root is None:
+            root = os.path.dirname(os.path.dirname(os.path.abspath(path)))
+        self.root = os.path.abspath(root)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def full_path(self, path):
+        # Path of an indexed file (stored relative to the root) to open
+        return os.path.join(self.root, path)
+
+    def _relpath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def _upsert(self, rows):
+        placeholders = ", ".join("?" * len(COLUMNS))
+        with self._lock, self._db:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO traces ({', '.join(COLUMNS)}) VALUES ({placeholders})", rows
+            )
+
+    def add_files(self, paths):
+        # Index SAC files as they are written (.../dataset/event/file.SAC
+        # paths below the root, relative to the working directory or absolute)
+        rows = []
+        for path in paths:
+            relpath = self._relpath(path)
+            parts = os.path.normpath(relpath).split(os.sep)
+            stat = os.stat(path)
+            rows.append(trace_row(relpath, parts[-3], parts[-2], read_sac_header(path, HEADER_FIELDS), stat))
+        self._upsert(rows)
+        return len(rows)
+
+    def remove(self, dataset, event=None, paths=None):
+        # paths: as stored (relative to the root)
+        with self._lock, self._db:
+            if paths is not None:
+                self._db.executemany("DELETE FROM traces WHERE path = ?", [(p,) for p in paths])
+            elif event is not None:
+                self._db.execute("DELETE FROM traces WHERE dataset = ? AND event = ?", (dataset, event))
+            else:
+                self._db.execute("DELETE FROM traces WHERE dataset = ?", (dataset,))
+
+    def datasets(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT DISTINCT dataset FROM traces ORDER BY dataset")]
+
+    def sync(self, dataset, events=None, suffix=".SAC", processes=None):
+        # Bring the rows of the dataset (directory below the root) up to date
+        # for the given (default: all, including deleted) event directories;
+        # returns (updated, removed)
+        directory = os.path.join(self.root, dataset)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path, event, size, mtime_ns FROM traces WHERE dataset = ?", (dataset,)
+            ).fetchall()
+        known = {}
+        for row in rows:
+            known.setdefault(row["event"], {})[row["path"]] = (row["size"], row["mtime_ns"])
+        if events is None:
+            # Event directories on disk and those indexed before (maybe deleted)
+            events = {e.name for e in os.scandir(directory) if e.is_dir()} if os.path.isdir(directory) else set()
+            events = sorted(events | set(known))
+        events = list(events)
+        args = [(self.root, dataset, event, known.get(event, {}), suffix) for event in events]
+        processes = processes or os.cpu_count()
+        if processes == 1 or len(args) < 2:
+            results = list(map(_scan_event, args))
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                results = list(pool.map(_scan_event, args, chunksize=max(1, len(args) // (processes * 4))))
+        updated, removed = [], []
+        for event, (rows, paths) in zip(events, results):
+            updated.extend(rows)
+            removed.extend(set(known.get(event, {})) - set(paths))
+        self._upsert(updated)
+        self.remove(dataset, paths=removed)
+        return len(updated), len(removed)
+
+    def traces(self, dataset, event=None, network=None, station=None, channel=None, exclude_networks=()):
+        # Rows (sqlite3.Row) ordered by path (relative to the root)
+        query = "SELECT * FROM traces WHERE dataset = ?"
+        params = [dataset]
+        for column, value in (("event", event), ("network", network), ("station", station), ("channel", channel)):
+            if value is not None:
+                query += f" AND {column} = ?"
+                params.append(value)
+        if exclude_networks:
+            query += f" AND network NOT IN ({', '.join('?' * len(exclude_networks))})"
+            params.extend(exclude_networks)
+        with self._lock:
+            return self._db.execute(query + " ORDER BY path", params).fetchall()
+
+    def complete_stations(self, dataset, event=None, channels=TRIPLET, exclude_networks=()):
+        # [(event, network, station, {channel: path})] of the stations that
+        # have every one of channels (paths relative to the root)
+        query = f"""
+            SELECT event, network, station, GROUP_CONCAT(channel, '|'), GROUP_CONCAT(path, '|')
+            FROM traces WHERE dataset = ? AND channel IN ({', '.join('?' * len(channels))})
+        """
+        params = [dataset, *channels]
+        if event is not None:
+            query += " AND event = ?"
+            params.append(event)
+        if exclude_networks:
+            query += f" AND network NOT IN ({', '.join('?' * len(exclude_networks))})"
+            params.extend(exclude_networks)
+        query += f"""
+            GROUP BY event, network, station
+            HAVING COUNT(DISTINCT channel) = {len(channels)}
+            ORDER BY event, network, station
+        """
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [
+            (event, network, station, dict(zip(cha.split("|"), paths.split("|"))))
+            for event, network, station, cha, paths in rows
+        ]
@@ -0,0 +1,252 @@
+###############################################################################
+# Description:
+# Precomputed travel-time tables over a distance x source-depth grid, for the
+# local events of the campaign (2-100 km, depth <= 15 km) that would
+# otherwise be ray traced trace by trace. Each node holds the exact TauP first
+# p/P and s/S arrival (nafz.travel_times); lookups interpolate bilinearly,
+# vectorized over any number of station-event pairs, and fall back to exact
+# TauP outside the grid. Tables are saved as .npz under .cache/travel_times,
+# named by a hash of the model, phases and grid, and built on first use
+# (about a minute per model, logged to the nafz.travel_time_table logger):
+#     table = travel_time_table("prem")
+#     times = table.first_arrivals(gcarc, evdp)   # as TravelTimes
+#     check_table(table)                          # error against exact TauP
+# Models: any obspy TauP model name (prem, iasp91, ...) or a local layered
+# crust of LOCAL_MODELS spliced onto the PREM mantle and built with obspy's
+# build_taup_model ("example_layered" is an illustrative placeholder).
+###############################################################################
+import hashlib
+import json
+import logging
+import os
+import time
+import numpy as np
+import obspy
+import obspy.taup
+from obspy.taup.taup_create import build_taup_model
+from nafz.catalog_io import file_sha256
+from nafz.travel_times import PHASES, TravelTimes
+
+###############################################################################
+logger = logging.getLogger("nafz.travel_time_table")
+TABLE_VERSION = 1
+TABLE_DIR = os.path.join(".cache", "travel_times")
+# Grid: epicentral distance [deg] (0-111 km) and source depth [km]
+DISTANCES = np.round(np.arange(0.0, 1.0 + 1e-9, 0.01), 6)
+DEPTHS = np.arange(0.0, 30.0 + 1e-9, 1.0)
+# Illustrative placeholder, NOT a published or calibrated model of the NAFZ:
+# round-number layers (top of layer [km], vp, vs [km/s], rho [g/cm^3]) with
+# Vp/Vs 1.73 and a 35 km Moho, only to show how a local crust is used. Add
+# the sourced local model of the study to LOCAL_MODELS under its own name
+# before using it for picks (the tables are rebuilt when a model changes).
+EXAMPLE_CRUST = (
+    (0.0, 5.40, 3.12, 2.55),
+    (3.0, 5.90, 3.41, 2.70),
+    (12.0, 6.20, 3.58, 2.80),
+    (22.0, 6.70, 3.87, 2.95),
+)
+EXAMPLE_MOHO = 35.0
+# Local models: name -> (crust layers, Moho depth [km]); the mantle is PREM
+LOCAL_MODELS = {"example_layered": (EXAMPLE_CRUST, EXAMPLE_MOHO)}
+
+
+def _read_nd(path):
+    # Lines of an .nd model split at the "mantle" keyword
+    with open(path) as f:
+        lines = [line.rstrip("\n") for line in f if line.strip()]
+    mantle = lines.index("mantle")
+    return lines[:mantle], lines[mantle + 1:]
+
+
+def local_model_nd(crust, moho, base="prem"):
+    # Text of an .nd model: the crust layers down to the Moho, then the
+    # mantle and core of the base model (interpolated at the Moho)
+    _, deeper = _read_nd(os.path.join(os.path.dirname(obspy.taup.__file__), "data", f"{base}.nd"))
+    first_keyword = next(i for i, line in enumerate(deeper) if not line.split()[0][0].isdigit())
+    mantle = np.array([[float(v) for v in line.split()] for line in deeper[:first_keyword]])
+    below = mantle[:, 0] > moho
+    top = [np.interp(moho, mantle[:, 0], mantle[:, i]) for i in range(mantle.shape[1])]
+    lines = []
+    bottoms = [layer[0] for layer in crust[1:]] + [moho]
+    for (depth, vp, vs, rho), bottom in zip(crust, bottoms):
+        for d in (depth, bottom):
+            lines.append(f"{d:8.2f} {vp:11.5f} {vs:9.5f} {rho:9.5f}    1456.0     600.0")
+    lines.append("mantle")
+    for row in [top] + list(mantle[below]):
+        lines.append(f"{row[0]:8.2f} " + " ".join(f"{v:9.5f}" for v in row[1:4])
+                     + "".join(f" {v:9.1f}" for v in row[4:]))
+    lines.extend(deeper[first_keyword:])
+    return "\n".join(lines) + "\n"
+
+
+def model_path(model, model_dir=TABLE_DIR):
+    # TauPyModel argument of a model: obspy's name, or the built .npz of a
+    # local model (rebuilt when its definition changes)
+    if model not in LOCAL_MODELS:
+        return model
+    os.makedirs(model_dir, exist_ok=True)
+    nd_path = os.path.join(model_dir, f"{model}.nd")
+    npz_path = os.path.join(model_dir, f"{model}.npz")
+    text = local_model_nd(*LOCAL_MODELS[model])
+    current = None
+    if os.path.exists(nd_path):
+        with open(nd_path) as f:
+            current = f.read()
+    if current != text or not os.path.exists(npz_path):
+        with open(nd_path, "w") as f:
+            f.write(text)
+        logger.info(f"Building TauP model {model} into {npz_path}")
+        build_taup_model(nd_path, output_folder=model_dir, verbose=False)
+    return npz_path
+
+
+def _table_key(model, model_file, distances, depths, phases):
+    return {
+        "version": TABLE_VERSION,
+        "obspy": obspy.__version__,
+        "model": model,
+        "model_file": model_file,
+        "model_sha256": file_sha256(model_file) if os.path.exists(model_file) else None,
+        "phases": {pick: list(names) for pick, names in phases.items()},
+        "distances": [float(d) for d in distances],
+        "depths": [float(z) for z in depths],
+    }
+
+
+class TravelTimeTable:
+    def __init__(self, model, distances, depths, times, names, key=None):
+        # times/names: {pick: (len(distances), len(depths)) arrays}
+        self.model = model
+        self.distances = np.asarray(distances, dtype=float)
+        self.depths = np.asarray(depths, dtype=float)
+        self.times = times
+        self.names = names
+        self.key = key
+        self._exact = None
+
+    def exact(self):
+        # TravelTimes (exact TauP) of the model and phases of the table
+        if self._exact is None:
+            phases = {pick: tuple(names) for pick, names in self.key["phases"].items()}
+            self._exact = TravelTimes(self.key["model_file"], phases)
+        return self._exact
+
+    @classmethod
+    def build(cls, model="prem", distances=DISTANCES, depths=DEPTHS, phases=PHASES, model_dir=TABLE_DIR):
+        path = model_path(model, model_dir)
+        times, names = TravelTimes(path, phases).first_arrivals(
+            np.asarray(distances, dtype=float)[:, None], np.asarray(depths, dtype=float)[None, :],
+            with_names=True,
+        )
+        names = {pick: value.astype(str) for pick, value in names.items()}
+        return cls(model, distances, depths, times, names, _table_key(model, path, distances, depths, phases))
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        arrays = {"distances": self.distances, "depths": self.depths}
+        for pick in self.times:
+            arrays[f"time_{pick}"] = self.times[pick]
+            arrays[f"name_{pick}"] = self.names[pick]
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, key=json.dumps(self.key), **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            key = json.loads(str(f["key"]))
+            picks = [name[len("time_"):] for name in f.files if name.startswith("time_")]
+            return cls(
+                key["model"], f["distances"], f["depths"],
+                {pick: f[f"time_{pick}"] for pick in picks},
+                {pick: f[f"name_{pick}"] for pick in picks},
+                key,
+            )
+
+    def _cells(self, values, nodes):
+        # Index of the grid cell of each value and the fraction across it
+        step = np.diff(nodes)
+        if np.allclose(step, step[0]):
+            cell = np.floor((values - nodes[0]) / step[0])
+            cell = np.clip(np.nan_to_num(cell), 0, len(nodes) - 2).astype(np.intp)
+        else:
+            cell = np.clip(np.searchsorted(nodes, values, side="right") - 1, 0, len(nodes) - 2)
+        return cell, (values - nodes[cell]) / (nodes[cell + 1] - nodes[cell])
+
+    def first_arrivals(self, distances, depths, with_names=False):
+        # Bilinear interpolation of the tables at distances [deg] and depths
+        # [km] (broadcast together); points outside the grid or next to a
+        # node without an arrival are computed with exact TauP. Names are
+        # those of the nearest node.
+        distances, depths = np.broadcast_arrays(
+            np.asarray(distances, dtype=float), np.asarray(depths, dtype=float)
+        )
+        i, fx = self._cells(distances, self.distances)
+        j, fz = self._cells(depths, self.depths)
+        inside = (fx >= 0) & (fx <= 1) & (fz >= 0) & (fz <= 1)
+        finite = np.isfinite(distances) & np.isfinite(depths)
+        # Corners of the cells in the flattened tables
+        nz = len(self.depths)
+        k = i * nz + j
+        times, names = {}, {}
+        exact = ~inside & finite
+        for pick, table in self.times.items():
+            table = table.ravel()
+            near = table[k] + fx * (table[k + nz] - table[k])
+            far = table[k + 1] + fx * (table[k + nz + 1] - table[k + 1])
+            times[pick] = near + fz * (far - near)
+            times[pick][~finite] = np.nan
+            exact |= np.isnan(times[pick]) & finite
+            if with_names:
+                nearest = (i + (fx > 0.5), j + (fz > 0.5))
+                names[pick] = self.names[pick][nearest].astype(object)
+                names[pick][~finite] = ""
+        if exact.any():
+            exact_times, exact_names = self.exact().first_arrivals(distances[exact], depths[exact], with_names=True)
+            for pick in times:
+                times[pick][exact] = exact_times[pick]
+                if with_names:
+                    names[pick][exact] = exact_names[pick]
+        if with_names:
+            return times, names
+        return times
+
+
+def travel_time_table(model="prem", distances=DISTANCES, depths=DEPTHS, phases=PHASES, table_dir=TABLE_DIR):
+    # Saved table of a model and grid, built (and saved) if there is none
+    path = model_path(model, table_dir)
+    key = _table_key(model, path, distances, depths, phases)
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+    table_path = os.path.join(table_dir, f"{model}.{digest}.npz")
+    if os.path.exists(table_path):
+        try:
+            table = TravelTimeTable.load(table_path)
+            if table.key == key:
+                return table
+        except (OSError, ValueError, KeyError):
+            pass
+    logger.info(
+        f"Building travel-time table of {model} ({len(distances)} distances x {len(depths)} depths, "
+        f"once) into {table_path}"
+    )
+    t0 = time.perf_counter()
+    table = TravelTimeTable.build(model, distances, depths, phases, table_dir)
+    table.save(table_path)
+    logger.info(f"Built travel-time table of {model} in {time.perf_counter() - t0:.0f} s")
+    return table
+
+
+def check_table(table, n=500, seed=0, max_distance=None, max_depth=None):
+    # {pick: (max, RMS absolute error [s])} of the table lookups against
+    # exact TauP at random points inside the grid
+    rng = np.random.default_rng(seed)
+    distances = rng.uniform(table.distances[0], max_distance or table.distances[-1], n)
+    depths = rng.uniform(table.depths[0], max_depth or table.depths[-1], n)
+    approx = table.first_arrivals(distances, depths)
+    exact = table.exact().first_arrivals(distances, depths)
+    errors = {}
+    for pick in approx:
+        error = np.abs(approx[pick] - exact[pick])
+        error = error[np.isfinite(error)]
+        errors[pick] = (float(error.max()), float(np.sqrt(np.mean(error ** 2))))
+    return errors
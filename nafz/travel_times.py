@@ -0,0 +1,165 @@
+###############################################################################
+# Description:
+# In-process theoretical travel times (obspy.taup) replacing the Java
+# `taup setsac` subprocess. TravelTimes loads the model once and, for arrays
+# of distances and depths, depth-corrects it once per distinct depth and
+# builds each phase once, so all station-event pairs of a catalog are one
+# call:
+#     times = TravelTimes("prem").first_arrivals(gcarc, evdp)
+#     times["P"]    # first of the p/P arrivals [s], NaN where there is none
+# set_arrival_headers writes the picks into the SAC headers as `taup setsac
+# -evdpkm -ph P-1,S-2` did (t1/t2 = o + travel time, kt1/kt2 = phase name),
+# patching the headers in place. Unlike Java taup, which wrote "P"/"S", kt1/kt2
+# name the first arrival: "p"/"s" (up-going) for most local crustal events,
+# "P"/"S" otherwise. set_event_arrivals does the same for many events in a
+# process pool, with exact TauP or with the precomputed tables of
+# nafz.travel_time_table (table=True).
+###############################################################################
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import numpy as np
+from obspy.geodetics import locations2degrees
+from obspy.taup import TauPyModel
+from obspy.taup.seismic_phase import SeismicPhase
+from nafz.sac_scan import read_sac_header, write_sac_header
+
+###############################################################################
+# Pick name: TauP phases it is the first arrival of. With a crustal source
+# the direct arrival at local distances is the up-going p/s, which TauP does
+# not count as P/S.
+PHASES = {"P": ("p", "P"), "S": ("s", "S")}
+# SAC header of each pick (t1 = P, t2 = S)
+PICK_HEADERS = {"P": 1, "S": 2}
+ARRIVAL_FIELDS = ("evla", "evlo", "evdp", "stla", "stlo", "gcarc", "o")
+
+
+class TravelTimes:
+    def __init__(self, model="prem", phases=PHASES, receiver_depth=0.0):
+        self.model_name = model
+        self.model = TauPyModel(model).model
+        self.phases = dict(phases)
+        self.receiver_depth = receiver_depth
+        self._seismic_phases = lru_cache(maxsize=64)(self._build_phases)
+
+    def _build_phases(self, depth):
+        # {pick: [SeismicPhase]} on the model corrected for a source depth
+        tau_model = self.model.depth_correct(depth)
+        if self.receiver_depth != depth:
+            tau_model = tau_model.split_branch(self.receiver_depth)
+        return {
+            pick: [SeismicPhase(name, tau_model, self.receiver_depth) for name in names]
+            for pick, names in self.phases.items()
+        }
+
+    def first_arrivals(self, distances, depths, with_names=False):
+        # {pick: travel times [s]} of the first arrival of each pick at the
+        # distances [deg] and source depths [km] (broadcast together); NaN
+        # where no phase of the pick arrives. with_names also returns
+        # {pick: phase names}.
+        distances, depths = np.broadcast_arrays(
+            np.asarray(distances, dtype=float), np.asarray(depths, dtype=float)
+        )
+        times = {pick: np.full(distances.shape, np.nan) for pick in self.phases}
+        names = {pick: np.full(distances.shape, "", dtype=object) for pick in self.phases}
+        unique_depths, inverse = np.unique(depths, return_inverse=True)
+        inverse = inverse.reshape(distances.shape)
+        for i, depth in enumerate(unique_depths):
+            if not np.isfinite(depth):
+                continue
+            phases = self._seismic_phases(float(depth))
+            for index in zip(*np.nonzero(inverse == i)):
+                degrees = distances[index]
+                if not np.isfinite(degrees):
+                    continue
+                for pick, seismic_phases in phases.items():
+                    for phase in seismic_phases:
+                        for arrival in phase.calc_time(degrees):
+                            if not arrival.time >= times[pick][index]:
+                                times[pick][index] = arrival.time
+                                names[pick][index] = arrival.name
+        if with_names:
+            return times, names
+        return times
+
+
+def arrival_headers(headers, travel_times):
+    # {tN: o + travel time, ktN: phase} of SAC headers (nafz.sac_scan dicts
+    # with ARRIVAL_FIELDS); None for headers without the event depth or
+    # distance
+    distances, depths = [], []
+    for header in headers:
+        gcarc = header.get("gcarc")
+        if gcarc is None and all(k in header for k in ("evla", "evlo", "stla", "stlo")):
+            gcarc = locations2degrees(header["evla"], header["evlo"], header["stla"], header["stlo"])
+        distances.append(np.nan if gcarc is None else gcarc)
+        depths.append(header.get("evdp", np.nan))
+    times, names = travel_times.first_arrivals(distances, depths, with_names=True)
+    result = []
+    for i, header in enumerate(headers):
+        if not (np.isfinite(distances[i]) and np.isfinite(depths[i])):
+            result.append(None)
+            continue
+        values = {}
+        for pick, n in PICK_HEADERS.items():
+            if np.isfinite(times[pick][i]):
+                values[f"t{n}"] = header.get("o", 0.0) + times[pick][i]
+                values[f"kt{n}"] = names[pick][i]
+        result.append(values)
+    return result
+
+
+def set_arrival_headers(paths, travel_times):
+    # Write the picks into the SAC files; returns the paths that are
+    # unreadable or lack the event depth or distance headers. Files are
+    # patched in place, so hard links (local_vel_data -> vel_data) get the
+    # picks as well.
+    headers = []
+    for path in paths:
+        try:
+            headers.append(read_sac_header(path, ARRIVAL_FIELDS))
+        except (OSError, ValueError):
+            headers.append({})
+    missing = []
+    for path, values in zip(paths, arrival_headers(headers, travel_times)):
+        if values is None:
+            missing.append(path)
+        elif values:
+            write_sac_header(path, values)
+    return missing
+
+
+_worker_times = None
+
+
+def _travel_times(model, table):
+    if table:
+        # Imported here: nafz.travel_time_table builds on this module
+        from nafz.travel_time_table import travel_time_table
+        return travel_time_table(model)
+    return TravelTimes(model)
+
+
+def _init_worker(model, table):
+    global _worker_times
+    _worker_times = _travel_times(model, table)
+
+
+def _set_event(paths):
+    return set_arrival_headers(paths, _worker_times)
+
+
+def set_event_arrivals(events, model="prem", processes=None, table=False):
+    # set_arrival_headers over {event: [SAC paths]} with one process per
+    # event at a time (the model is loaded once per worker); yields
+    # (event, missing paths) in the order of events
+    events = dict(events)
+    processes = min(processes or os.cpu_count(), max(1, len(events)))
+    # Built (and saved) here, so the workers only load it
+    travel_times = _travel_times(model, table)
+    if processes == 1:
+        for event, paths in events.items():
+            yield event, set_arrival_headers(paths, travel_times)
+        return
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(model, table)) as pool:
+        yield from zip(events, pool.map(_set_event, events.values()))
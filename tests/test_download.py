@@ -0,0 +1,70 @@
+###############################################################################
+# Description:
+# nafz.download against the offline FDSN stand-in (nafz.fake_fdsn) with
+# failing requests: every event must end complete (one miniSEED file per
+# channel of the synthetic network) and journaled done, or journaled failed
+# so the next run retries it. Run from the repository root: python -m pytest
+###############################################################################
+import logging
+import os
+import sys
+import pytest
+from obspy import UTCDateTime
+from obspy.clients.fdsn.mass_downloader import RectangularDomain, Restrictions
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nafz.download import MASS_DOWNLOADER_LOGGER, DownloadScheduler
+from nafz.fake_fdsn import FakeFDSNServer
+from nafz.journal import DownloadJournal
+
+###############################################################################
+START = UTCDateTime("2013-01-01")
+N_EVENTS = 8
+N_STATIONS = 4
+
+
+def make_requests(root):
+    domain = RectangularDomain(minlatitude=40.0, maxlatitude=41.2, minlongitude=29.6, maxlongitude=31.0)
+    requests = []
+    for i in range(N_EVENTS):
+        origin = START + i * 3600
+        name = origin.strftime("%Y%m%d%H%M%S")
+        restrictions = Restrictions(
+            starttime=origin - 30, endtime=origin + 150,
+            channel_priorities=["BH[ENZ]"], location_priorities=[""],
+        )
+        requests.append((name, domain, restrictions,
+                         os.path.join(root, "data", name), os.path.join(root, "response", name)))
+    return requests
+
+
+@pytest.fixture(autouse=True)
+def quiet_mass_downloader():
+    # No console handler of the mass downloader (configure_logging)
+    handler = logging.NullHandler()
+    MASS_DOWNLOADER_LOGGER.addHandler(handler)
+    yield
+    MASS_DOWNLOADER_LOGGER.removeHandler(handler)
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_failed_requests_are_not_journaled_done(tmp_path, cached):
+    window = (START - 86400, START + (N_EVENTS + 1) * 3600) if cached else None
+    journal = DownloadJournal(str(tmp_path / "journal.sqlite"))
+    with FakeFDSNServer(n_stations=N_STATIONS, failure_rate=0.3, seed=1) as server:
+        scheduler = DownloadScheduler(
+            providers=[server.url], retries=1, backoff=0.0, journal=journal,
+            availability_window=window, client_kwargs={"_discover_services": False},
+        )
+        requests = make_requests(str(tmp_path))
+        scheduler.run(requests, progress=False)
+        failures = sum(stats["failures"] for stats in server.stats.values())
+    assert failures
+    expected = N_STATIONS * 3
+    for name, *_, mseed_storage, _ in requests:
+        files = len(os.listdir(mseed_storage)) if os.path.isdir(mseed_storage) else 0
+        status = journal.status(name)
+        assert status in ("done", "failed")
+        if status == "done":
+            assert files == expected, f"{name} journaled done with {files} of {expected} files"
+    journal.close()